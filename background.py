@@ -0,0 +1,125 @@
+# Callbacks pesados en segundo plano (background callbacks de Dash con DiskcacheManager):
+# la petición no bloquea el worker, se muestra el progreso y se cancela el trabajo anterior
+# si cambian las entradas. Sin diskcache (o con BACKGROUND_CALLBACKS=0) son callbacks normales.
+import os
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from dash import html
+from dash.dependencies import Output
+from app import app
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+BACKGROUND_CALLBACKS = os.environ.get("BACKGROUND_CALLBACKS", "1") == "1"
+BACKGROUND_DIR = "data/cache/background"
+# Trabajos pesados a la vez por worker, el resto espera su turno
+BACKGROUND_LIMIT = int(os.environ.get("BACKGROUND_LIMIT", 2))
+SLOTS_DIR = os.path.join(BACKGROUND_DIR, "slots")
+SLOT_WAIT = 0.2
+# Cada cuánto (ms) consulta el navegador el estado del trabajo
+INTERVAL = int(os.environ.get("BACKGROUND_INTERVAL", 300))
+_current = threading.local()
+
+def create_manager():
+    # DiskcacheManager necesita diskcache, multiprocess y psutil
+    if not BACKGROUND_CALLBACKS:
+        return None
+    try:
+        import diskcache
+        from dash import DiskcacheManager
+        return DiskcacheManager(diskcache.Cache(BACKGROUND_DIR))
+    except ImportError as e:
+        print(f"Background callbacks disabled ({e}), running heavy callbacks in the request")
+        return None
+
+def prune_slots():
+    # Bloqueos de workers que ya no existen (gunicorn reinicia los workers cada max_requests)
+    if not os.path.isdir(SLOTS_DIR):
+        return
+    for name in os.listdir(SLOTS_DIR):
+        pid = int(name.split("-")[0])
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            try:
+                os.remove(os.path.join(SLOTS_DIR, name))
+            except OSError:
+                pass
+        except PermissionError:
+            pass
+
+manager = create_manager()
+prune_slots()
+
+@contextmanager
+def job_slot(owner, on_wait = None):
+    # Uno de los BACKGROUND_LIMIT bloqueos (flock) del worker owner; se liberan si el proceso muere
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(SLOTS_DIR, exist_ok = True)
+    while True:
+        for i in range(BACKGROUND_LIMIT):
+            file = open(os.path.join(SLOTS_DIR, f"{owner}-{i}.lock"), "a")
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                file.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+                file.close()
+            return
+        if on_wait is not None:
+            on_wait()
+        time.sleep(SLOT_WAIT)
+
+def report(step, total):
+    # Progreso del trabajo actual; fuera de un callback en segundo plano no hace nada
+    set_progress = getattr(_current, "set_progress", None)
+    if set_progress is not None:
+        set_progress((step, total))
+
+def progress_bar(id):
+    # Barra de progreso oculta, se muestra mientras el callback se ejecuta (sin valor = indeterminada)
+    return html.Progress(id = id, style = {"display": "none", "width": "100%"})
+
+def heavy_callback(output, inputs, progress_id, cancel = None):
+    """
+    Register a heavy callback: a background callback when the manager is
+    available (progress in the progress_id bar, cancelled when cancel
+    changes or when a newer request of the same callback starts), a
+    normal callback otherwise. Both are limited to BACKGROUND_LIMIT jobs
+    at a time per worker. The decorated function is returned unchanged,
+    so it can still be called directly.
+    """
+    running = [(Output(progress_id, "style"), {"display": "block", "width": "100%"}, {"display": "none", "width": "100%"})]
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args):
+            if manager is not None:
+                # El trabajo se ejecuta en un proceso hijo del worker
+                _current.set_progress, args, owner = args[0], args[1:], os.getppid()
+            else:
+                _current.set_progress, owner = None, os.getpid()
+            try:
+                with job_slot(owner, lambda: report(0, 1)):
+                    return function(*args)
+            finally:
+                _current.set_progress = None
+
+        if manager is not None:
+            app.callback(output, inputs, background = True, manager = manager, interval = INTERVAL, running = running,
+                         progress = [Output(progress_id, "value"), Output(progress_id, "max")],
+                         cancel = cancel)(wrapper)
+        else:
+            app.callback(output, inputs, running = running)(wrapper)
+        return function
+    return decorator
@@ -0,0 +1,48 @@
+# Compara la carga y la predicción del modelo en pickle (scikit-learn) y exportado (NumPy).
+# Uso (desde la raíz del proyecto): python -m benchmarks.inference [repeticiones]
+import sys
+import time
+import pickle
+import warnings
+import numpy as np
+from utils import exists
+import model
+from inference import load_fused, probe_inputs, predict_all
+
+def best(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+def load_pickle(path):
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+def run(repeat = 20):
+    warnings.filterwarnings("ignore", message = "X does not have valid feature names")
+    status, info = exists("model")
+    path = info[3]
+    sklearn_models = load_pickle(path)
+    model.export_arrays(info, sklearn_models)
+    fused = load_fused(model.MODEL_ARRAYS_PATH)
+    results = []
+    results.append(("load", "sklearn", best(lambda: load_pickle(path), repeat)))
+    results.append(("load", "numpy", best(lambda: load_fused(model.MODEL_ARRAYS_PATH), repeat)))
+    for rows in [1, 100, 10000]:
+        X = probe_inputs(5, rows)
+        results.append((f"predict {rows} rows", "sklearn", best(lambda: predict_all(sklearn_models, X), repeat)))
+        results.append((f"predict {rows} rows", "numpy", best(lambda: predict_all(fused, X), repeat)))
+    X = probe_inputs(5, 1000)
+    error = np.abs(predict_all(sklearn_models, X) - predict_all(fused, X)).max()
+    return results, error
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    results, error = run(repeat)
+    print(f"{'operation':<22}{'engine':<10}{'ms':>10}")
+    for operation, engine, ms in results:
+        print(f"{operation:<22}{engine:<10}{ms:>10.3f}")
+    print(f"Max difference between engines: {error:.2e}")
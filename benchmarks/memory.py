@@ -0,0 +1,93 @@
+# Memoria de cada dataset con los tipos por defecto de pandas (float64, strings como object)
+# y con los esquemas de data.py (categorías y float32), y de los stores de la página Home.
+# Uso (desde la raíz del proyecto): python -m benchmarks.memory
+import gc
+import ctypes
+import sys
+import json
+import subprocess
+import numpy as np
+import pandas as pd
+import storage
+import shared
+import timeseries
+from utils import exists
+from data import load_data, memory_usage, SCHEMAS
+
+DATASETS = ["weather-pollution", "stations", "trees", "traffic", "month-weather"]
+
+def legacy(data):
+    # Tipos por defecto de pandas: float64 y object
+    dtypes = {column: "float64" for column in data.columns if data[column].dtype == "float32"}
+    dtypes.update({column: object for column in data.columns if data[column].dtype == "category"})
+    return data.astype(dtypes) if dtypes else data
+
+def legacy_stores(weather_pollution):
+    # Stores como antes del esquema: un store por nivel (también el diario) y columnas float64
+    grouped = weather_pollution.groupby(["station", "date"]).mean().reset_index()
+    order = list(weather_pollution["station"].unique())
+    levels = {"raw": grouped}
+    for level, freq in timeseries.LEVELS.items():
+        if freq is not None:
+            levels[level] = grouped.groupby(["station", pd.Grouper(key = "date", freq = freq)]).mean(numeric_only = True).reset_index()
+    stores = {level: timeseries.StationStore.from_frame(data, order) for level, data in levels.items()}
+    for store in stores.values():
+        store.columns = {name: values.astype(float) for name, values in store.columns.items()}
+    return stores
+
+def stores_bytes(stores):
+    # Bytes de los arrays, contando una vez los stores compartidos entre niveles
+    unique = {id(store): store for store in stores.values()}.values()
+    return sum(store.dates.nbytes + sum(values.nbytes for values in store.columns.values()) for store in unique)
+
+def datasets():
+    results = []
+    for name in DATASETS:
+        status, info = exists(name)
+        data = load_data(info)
+        before = memory_usage(legacy(storage.read(info[3])))
+        results.append({"dataset": name, "rows": len(data), "schema": name in SCHEMAS,
+                        "before_mb": before / 2**20, "after_mb": memory_usage(data) / 2**20})
+    return results
+
+def trim():
+    # Devuelve al sistema la memoria ya liberada (glibc), para medir solo la que sigue en uso
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def measure(mode):
+    # En un proceso nuevo: memoria anónima que queda tras construir los stores de Home
+    status, info = exists("weather-pollution")
+    build = (lambda: legacy_stores(legacy(storage.read(info[3])))) if mode == "legacy" else (lambda: timeseries.build_stores(load_data(info)))
+    # Una primera construcción que se descarta: importaciones y cachés internas de pandas
+    build()
+    trim()
+    before = shared.memory_usage()
+    stores = build()
+    trim()
+    total = sum(float(np.nansum(values)) for store in stores.values() for values in store.columns.values())
+    after = shared.memory_usage()
+    return {"arrays_mb": stores_bytes(stores) / 2**20, "anon_mb": (after["RssAnon"] - before["RssAnon"]) / 1024,
+            "total": total}
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--measure":
+        print(json.dumps(measure(sys.argv[2])))
+        sys.exit(0)
+    print(f"{'dataset':<20}{'rows':>8}{'before MB':>12}{'after MB':>12}{'ratio':>8}")
+    for result in datasets():
+        print(f"{result['dataset']:<20}{result['rows']:>8}{result['before_mb']:>12.2f}{result['after_mb']:>12.2f}"
+              f"{result['before_mb'] / max(result['after_mb'], 1e-9):>8.2f}")
+    results = {}
+    for mode in ["legacy", "schema"]:
+        output = subprocess.run([sys.executable, "-m", "benchmarks.memory", "--measure", mode],
+                                stdout = subprocess.PIPE, text = True, check = True)
+        results[mode] = json.loads(output.stdout.splitlines()[-1])
+    print(f"\n{'Home stores':<20}{'arrays MB':>12}{'anon MB':>12}")
+    for mode, result in results.items():
+        print(f"{mode:<20}{result['arrays_mb']:>12.2f}{result['anon_mb']:>12.2f}")
+    print(f"{'ratio':<20}{results['legacy']['arrays_mb'] / results['schema']['arrays_mb']:>12.2f}"
+          f"{results['legacy']['anon_mb'] / max(results['schema']['anon_mb'], 1e-9):>12.2f}")
@@ -0,0 +1,53 @@
+# Comprueba que el preprocesado vectorizado de download_data da el mismo resultado que el anterior
+# (lambdas por fila y un filtro por estación) y mide la mejora.
+# La comparación se comprueba también en tests/test_preprocessing.py (pytest), con las mismas
+# implementaciones de referencia (tests/reference.py).
+# Uso (desde la raíz del proyecto): python -m benchmarks.preprocessing [árboles] [filas weather-pollution]
+import sys
+import time
+import numpy as np
+import pandas as pd
+from data import preprocess_trees, station_means, extract_points, STATION_NAMES
+from tests.reference import legacy_trees, legacy_points, legacy_means
+from tests.synthetic import synthetic_trees, synthetic_weather_pollution
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def run(n_trees = 300000, n_rows = 2000000):
+    results = []
+    rng = np.random.default_rng(0)
+    trees_raw = synthetic_trees(rng, n_trees)
+    expected, legacy_time = timed(legacy_trees, trees_raw)
+    actual, new_time = timed(preprocess_trees, trees_raw)
+    pd.testing.assert_frame_equal(actual, expected, check_exact = True)
+    results.append(("trees", legacy_time, new_time))
+
+    (lon, lat), legacy_time = timed(legacy_points, trees_raw)
+    coords, new_time = timed(extract_points, trees_raw["geo_point_2d"])
+    assert np.array_equal(coords["lon"].to_numpy(), lon.to_numpy()) and np.array_equal(coords["lat"].to_numpy(), lat.to_numpy())
+    results.append(("coordinates", legacy_time, new_time))
+
+    # Una fila diaria por estación, repetida hasta unas n_rows filas
+    weather_pollution = synthetic_weather_pollution(rng)
+    weather_pollution = synthetic_weather_pollution(rng, scale = max(1, round(n_rows / len(weather_pollution))))
+    # Medidas en float64 (como los datos sin esquema) para comparar con rtol = 1e-12
+    weather_pollution = weather_pollution.astype({column: "float64" for column in ["co", "so2", "pm2_5"]})
+    names = list(STATION_NAMES)
+    expected, legacy_time = timed(legacy_means, names, weather_pollution)
+    actual, new_time = timed(station_means, names, weather_pollution)
+    # La suma del groupby puede diferir en el último bit frente a Series.mean
+    pd.testing.assert_frame_equal(actual, expected, check_exact = False, rtol = 1e-12)
+    results.append(("station means", legacy_time, new_time))
+    return results
+
+if __name__ == "__main__":
+    n_trees = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    n_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 2000000
+    results = run(n_trees, n_rows)
+    print("Same output as the previous implementation")
+    print(f"{'step':<16}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for step, before, after in results:
+        print(f"{step:<16}{before * 1000:>12.1f}{after * 1000:>12.1f}{before / after:>9.1f}x")
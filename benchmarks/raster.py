@@ -0,0 +1,40 @@
+# Tiempo y pico de memoria de las variables de la malla de predicción (raster.compute_features)
+# con los árboles y tramos del repositorio escalados (copias desplazadas). La igualdad con el cálculo
+# por celda se comprueba en tests/test_raster.py.
+# Sale con código 1 si se pasa del presupuesto (por defecto 10^5 celdas a 100x: MAX_SECONDS y MAX_PEAK_MB).
+# Uso (desde la raíz del proyecto): python -m benchmarks.raster [escala] [celdas]
+import sys
+import time
+import tracemalloc
+import numpy as np
+import storage
+import raster
+from spatial import build_trees_index, build_traffic_index
+from tests.synthetic import scale_trees, scale_traffic
+from tests.workspace import data_path
+
+MAX_SECONDS = 20
+MAX_PEAK_MB = 300
+
+def run(scale = 100, cells = 100000):
+    rng = np.random.default_rng(0)
+    trees = scale_trees(rng, storage.JSONBackend().read(data_path("trees.json")), scale)
+    traffic = scale_traffic(rng, storage.JSONBackend().read(data_path("traffic.json")), scale)
+    tracemalloc.start()
+    start = time.perf_counter()
+    lon, lat = raster.raster_grid(raster.raster_bounds(trees), cells = cells)
+    density, cars = raster.compute_features(lon, lat, build_trees_index(trees), build_traffic_index(traffic))
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return len(trees), len(traffic), len(density), seconds, peak
+
+if __name__ == "__main__":
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    cells = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    n_trees, n_traffic, n_cells, seconds, peak = run(scale, cells)
+    print(f"{n_cells} cells, {n_trees} tree points, {n_traffic} traffic segments")
+    print(f"{seconds:.2f} s (budget {MAX_SECONDS} s), peak {peak:.0f} MB (budget {MAX_PEAK_MB} MB)")
+    if seconds > MAX_SECONDS or peak > MAX_PEAK_MB:
+        print("Over budget")
+        sys.exit(1)
@@ -0,0 +1,45 @@
+# Compara la memoria (RSS) de varios procesos que cargan los datos de las páginas
+# con get_data (copia por proceso) o desde la instantánea compartida (memory-mapped).
+# Uso (desde la raíz del proyecto): python -m benchmarks.shared [procesos]
+import sys
+import json
+import subprocess
+import shared
+import timeseries
+
+def measure(mode):
+    before = shared.memory_usage()
+    if mode == "shared":
+        frames = [shared.attach(name) for name in shared.SHARED_DATASETS]
+    else:
+        frames = [shared.get_data(name) for name in shared.SHARED_DATASETS]
+    stores = timeseries.load_stores() if mode == "shared" else timeseries.build_stores(shared.get_data("weather-pollution"))
+    # Se leen todos los valores, como haría un worker tras unas cuantas peticiones
+    total = sum(float(frame.select_dtypes("number").to_numpy().sum()) for frame in frames)
+    total += sum(float(values.sum()) for store in stores.values() for values in store.columns.values())
+    after = shared.memory_usage()
+    return {key: after[key] - before[key] for key in after if key != "pid"}
+
+def run(processes):
+    timeseries.publish_stores()
+    results = {}
+    for mode in ["copy", "shared"]:
+        workers = [subprocess.Popen([sys.executable, "-m", "benchmarks.shared", "--measure", mode],
+                                    stdout = subprocess.PIPE, text = True) for _ in range(processes)]
+        results[mode] = [json.loads(worker.communicate()[0].splitlines()[-1]) for worker in workers]
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--measure":
+        print(json.dumps(measure(sys.argv[2])))
+    else:
+        processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+        results = run(processes)
+        print(f"{'mode':<10}{'worker':>8}{'RSS MB':>10}{'anon MB':>10}{'file MB':>10}")
+        for mode, usages in results.items():
+            for i, usage in enumerate(usages):
+                print(f"{mode:<10}{i:>8}{usage.get('VmRSS', 0) / 1024:>10.1f}"
+                      f"{usage.get('RssAnon', 0) / 1024:>10.1f}{usage.get('RssFile', 0) / 1024:>10.1f}")
+            # Las páginas de archivo se comparten entre procesos, la memoria anónima no
+            anon = sum(usage.get("RssAnon", 0) for usage in usages) / 1024
+            print(f"{mode:<10}{'total':>8}{'':>10}{anon:>10.1f}")
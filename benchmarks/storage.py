@@ -0,0 +1,75 @@
+# Compara el tiempo de carga y la memoria (RSS) de cada backend de almacenamiento.
+# Uso (desde la raíz del proyecto): python -m benchmarks.storage [dataset ...]
+import os
+import sys
+import json
+import time
+import subprocess
+from utils import exists
+import storage
+
+DATASETS = ["trees", "traffic", "stations", "month-weather", "weather-pollution"]
+
+def rss_kb():
+    # RSS actual del proceso en KB (Linux), sino el pico que da resource
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(name, backend_name, repeat = 5):
+    # Se ejecuta en un proceso nuevo para que la RSS no dependa de cargas anteriores
+    status, info = exists(name)
+    backend = storage.get_backend(backend_name)
+    path = info[3]
+    if not os.path.exists(storage.backend_path(path, backend)):
+        storage.write(storage.read(path), path, backend)
+    rss_before = rss_kb()
+    start = time.perf_counter()
+    data = storage.read(path, backend)
+    first = time.perf_counter() - start
+    rss_after = rss_kb()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        storage.read(path, backend)
+        times.append(time.perf_counter() - start)
+    return {
+        "dataset": name,
+        "backend": backend_name,
+        "rows": len(data),
+        "file_kb": os.path.getsize(storage.backend_path(path, backend)) // 1024,
+        "first_load_ms": round(first * 1000, 2),
+        "load_ms": round(min(times) * 1000, 2),
+        "rss_delta_kb": rss_after - rss_before
+    }
+
+def run(datasets):
+    results = []
+    for name in datasets:
+        status, info = exists(name)
+        if not status or not storage.exists(info[3]):
+            print(f"Skipping {name}: no local data")
+            continue
+        for backend_name in storage.BACKENDS:
+            if backend_name == "feather" and storage.pa is None:
+                continue
+            output = subprocess.run([sys.executable, "-m", "benchmarks.storage", "--measure", name, backend_name],
+                                    capture_output = True, text = True, check = True)
+            results.append(json.loads(output.stdout.splitlines()[-1]))
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--measure":
+        print(json.dumps(measure(sys.argv[2], sys.argv[3])))
+    else:
+        results = run(sys.argv[1:] or DATASETS)
+        print(f"{'dataset':<20}{'backend':<10}{'rows':>10}{'file KB':>10}{'first ms':>10}{'load ms':>10}{'RSS KB':>10}")
+        for r in results:
+            print(f"{r['dataset']:<20}{r['backend']:<10}{r['rows']:>10}{r['file_kb']:>10}"
+                  f"{r['first_load_ms']:>10}{r['load_ms']:>10}{r['rss_delta_kb']:>10}")
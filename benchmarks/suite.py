@@ -0,0 +1,229 @@
+# Benchmark de extremo a extremo: carga de datos, variables espaciales, preprocesado, modelo y callbacks.
+# Se ejecuta sin red sobre una copia de data/ (con datos sintéticos 10x, 100x...) en un proceso por escala.
+# Uso (desde la raíz del proyecto):
+#   python -m benchmarks.suite [--scales 1,10,100] [--steps get_data,train_models,...] [--repeat 3]
+#                              [--output benchmarks/results.json] [--baseline benchmarks/baseline.json] [--save-baseline]
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_PATH = os.path.join(ROOT, "benchmarks", "results.json")
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+# Resultados de cada proceso de escala, dentro de su directorio de trabajo
+WORKER_OUTPUT = "worker-results.json"
+# Archivos de ejecución que no se copian (cachés, bloqueos, estado del entrenamiento)
+IGNORE = shutil.ignore_patterns("cache", "shared", "*.lock", "*.tmp", "training.json", "model-grid.npz",
+                                "model.npz", "metadata-stats.json")
+# Una regresión es un cambio mayor que THRESHOLD veces y que MIN_DELTA segundos
+THRESHOLD = 1.25
+MIN_DELTA = 0.005
+
+def measure(function, repeat, setup = None):
+    # Primera ejecución con tracemalloc (pico de memoria), el resto sin él para los tiempos
+    # setup (sin medir) se llama antes de cada ejecución, p.ej. para vaciar cachés
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    first = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times = times or [first]
+    return {"first_s": round(first, 6), "min_s": round(min(times), 6), "mean_s": round(sum(times) / len(times), 6),
+            "peak_mb": round(peak / 2**20, 3)}
+
+def scale_datasets(scale):
+    # Datos sintéticos: copias desplazadas de árboles y tramos, y filas de weather-pollution con ruido
+    import numpy as np
+    import storage
+    import metadata
+    from utils import exists
+    from tests.synthetic import synthetic_weather_pollution, scale_trees, scale_traffic
+    rng = np.random.default_rng(0)
+    raw = {}
+    status, info = exists("trees")
+    trees = storage.read(info[3])
+    trees = scale_trees(rng, trees, scale)
+    raw[info[1]] = [{"nom_comu_c": "Platanus", "geo_point_2d": {"lon": lon + rng.uniform(-5e-4, 5e-4), "lat": lat + rng.uniform(-5e-4, 5e-4)}}
+                    for lon, lat in zip(trees["lon"], trees["lat"])]
+    status, info = exists("traffic")
+    traffic = storage.read(info[3])
+    traffic = scale_traffic(rng, traffic, scale)
+    raw[info[1]] = [{"idtramo": row.id, "des_tramo": row.name, "lectura": row.cars_per_hour, "geo_shape": row.geo_shape}
+                    for row in traffic.itertuples()]
+    status, info = exists("stations")
+    stations = storage.read(info[3])
+    raw[info[1]] = [{"nombre": row.name, "geo_point_2d": {"lon": row.lon, "lat": row.lat}} for row in stations.itertuples()]
+    # Siempre sintético (también a escala 1): los resultados no dependen de tener una descarga local
+    datasets = [("weather-pollution", synthetic_weather_pollution(rng, scale))]
+    if scale > 1:
+        datasets += [("trees", trees), ("traffic", traffic)]
+    for name, data in datasets:
+        status, info = exists(name)
+        storage.write(data, info[3])
+        metadata.record_update(name, datetime.strptime(info[2], "%Y-%m-%d"), data)
+    return raw
+
+def worker(scale, steps, repeat):
+    # Se ejecuta dentro de la copia de data/ con REFRESH_MODE=offline
+    raw = scale_datasets(scale)
+    import dash
+    from dash._utils import AttributeDict
+    import data
+    import model
+    from utils import exists, calculate_tree_density, calculate_traffic
+    results = []
+
+    def run(step, function, times = repeat, setup = None):
+        if steps and step.split(":")[0] not in steps:
+            return
+        result = measure(function, times, setup)
+        results.append(dict(scale = scale, step = step, **result))
+        print(f"  {step:<36}{result['min_s'] * 1000:>12.2f} ms{result['peak_mb']:>10.1f} MB", file = sys.stderr)
+
+    for name in ["trees", "traffic", "weather-pollution", "stations", "month-weather"]:
+        run(f"get_data:{name}", lambda name = name: data.get_data(name))
+    stations = data.get_data("stations")
+    trees = data.get_data("trees")
+    traffic = data.get_data("traffic")
+    run("calculate_tree_density", lambda: [calculate_tree_density(stations, trees, name) for name in stations["name"]])
+    run("calculate_traffic", lambda: [calculate_traffic(stations, traffic, name) for name in stations["name"]])
+    run("update_weather", model.update_weather)
+    run("train_models", lambda: model.train_models(exists("model")[1], n_jobs = 1), times = 0)
+    models = model.get_models()
+    run("predict", lambda: model.predict(models, [3, 1200, 150000]))
+    run("predict_batch:10000", lambda: model.predict_batch(models, [[m % 12 + 1, 500 + m % 2500, 50000 + m * 40] for m in range(10000)]))
+    # Callbacks llamados directamente, como si los disparase un cambio del selector
+    dash._callback_context.context_value.set(AttributeDict(triggered_inputs = [{"prop_id": "stations_selector.value"}]))
+    # Solo se puede importar una vez: registra la aplicación y los callbacks
+    run("import:index", lambda: __import__("index"), times = 0)
+    import pages.home
+    import pages.future
+    import pages.microclimates
+    import raster
+
+    def fresh_caches():
+        # Mapas (HTML en memoria y en disco) y malla de predicción sin caché: cada repetición los calcula
+        cache_dir = tempfile.mkdtemp(prefix = "cache-", dir = "data")
+        pages.microclimates.MAP_CACHE_DIR = cache_dir
+        pages.microclimates.map_cache.clear()
+        raster.RASTER_DIR = cache_dir
+        raster._features.update(key = None, features = None)
+        raster._predictions.clear()
+
+    selected = pages.home.get_stores()["raw"].stations[:3]
+    run("callback:get_barplot", lambda: pages.future.get_barplot("March", [1200], [150000]))
+    run("callback:get_map", pages.microclimates.get_map, setup = fresh_caches)
+    run("callback:get_weather_plot", lambda: pages.home.get_weather_plot(selected, "Temperature"))
+    run("callback:get_pollution_plot", lambda: pages.home.get_pollution_plot(selected, "NO2"))
+    run("callback:get_prediction", lambda: pages.microclimates.get_prediction("July", "co"), setup = fresh_caches)
+    # Descarga sustituida por los registros sintéticos (al final: reescribe los datasets)
+    get_json_data = data.get_json_data
+    data.get_json_data = lambda id_name, type_request = "get": raw[id_name]
+    try:
+        for name in ["trees", "traffic", "stations"]:
+            info = exists(name)[1]
+            run(f"download_data:{name}", lambda info = info: data.download_data(info, datetime.strptime(info[2], "%Y-%m-%d")))
+    finally:
+        data.get_json_data = get_json_data
+    # Entrenamiento en segundo plano lanzado por get_models: termina antes de borrar el directorio
+    if model._training["process"] is not None:
+        model._training["process"].wait()
+    return results
+
+def environment():
+    import numpy
+    import pandas
+    import sklearn
+    import dash
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "numpy": numpy.__version__, "pandas": pandas.__version__, "sklearn": sklearn.__version__, "dash": dash.__version__}
+
+def run_suite(scales, steps, repeat):
+    results = []
+    for scale in scales:
+        print(f"Scale {scale}x", file = sys.stderr)
+        workdir = tempfile.mkdtemp(prefix = f"benchmark-{scale}x-")
+        try:
+            shutil.copytree(os.path.join(ROOT, "data"), os.path.join(workdir, "data"), ignore = IGNORE)
+            # Sin memoización de callbacks: las repeticiones miden el cálculo, no la caché
+            env = dict(os.environ, REFRESH_MODE = "offline", PYTHONPATH = ROOT, TRAIN_N_JOBS = "1", CALLBACK_CACHE = "off")
+            command = [sys.executable, "-m", "benchmarks.suite", "--worker", "--scales", str(scale), "--repeat", str(repeat)]
+            if steps:
+                command += ["--steps", ",".join(steps)]
+            subprocess.run(command, cwd = workdir, env = env, check = True)
+            # En un archivo y no en stdout: el entrenamiento en segundo plano también escribe en stdout
+            with open(os.path.join(workdir, WORKER_OUTPUT)) as file:
+                results += json.load(file)
+        finally:
+            shutil.rmtree(workdir, ignore_errors = True)
+    return {"created": datetime.now().isoformat(timespec = "seconds"), "environment": environment(),
+            "repeat": repeat, "results": results}
+
+def compare(report, baseline, threshold = THRESHOLD):
+    # Compara tiempo (min_s) y memoria (peak_mb) de cada paso con la referencia, devuelve las regresiones
+    previous = {(r["scale"], r["step"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"{'scale':>6} {'step':<36}{'base ms':>12}{'ms':>12}{'ratio':>8}{'base MB':>10}{'MB':>10}")
+    for result in report["results"]:
+        old = previous.get((result["scale"], result["step"]))
+        if old is None or "min_s" not in result:
+            continue
+        ratio = result["min_s"] / old["min_s"] if old["min_s"] > 0 else 1
+        slower = ratio > threshold and result["min_s"] - old["min_s"] > MIN_DELTA
+        bigger = result["peak_mb"] > old["peak_mb"] * threshold and result["peak_mb"] - old["peak_mb"] > 1
+        flag = " <-" if slower or bigger else ""
+        print(f"{result['scale']:>6} {result['step']:<36}{old['min_s'] * 1000:>12.2f}{result['min_s'] * 1000:>12.2f}"
+              f"{ratio:>8.2f}{old['peak_mb']:>10.1f}{result['peak_mb']:>10.1f}{flag}")
+        if flag:
+            regressions.append(result)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "End-to-end benchmark suite")
+    parser.add_argument("--scales", default = "1,10,100")
+    parser.add_argument("--steps", default = "")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--output", default = OUTPUT_PATH)
+    parser.add_argument("--baseline", default = None)
+    parser.add_argument("--save-baseline", action = "store_true")
+    parser.add_argument("--threshold", type = float, default = THRESHOLD)
+    parser.add_argument("--worker", action = "store_true")
+    args = parser.parse_args()
+    scales = [int(scale) for scale in args.scales.split(",")]
+    steps = [step for step in args.steps.split(",") if step]
+    if args.worker:
+        results = worker(scales[0], steps, args.repeat)
+        with open(WORKER_OUTPUT, "w") as file:
+            json.dump(results, file)
+        sys.exit(0)
+    report = run_suite(scales, steps, args.repeat)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent = 4)
+    print(f"Results written to {args.output}")
+    if args.save_baseline:
+        shutil.copyfile(args.output, BASELINE_PATH)
+        print(f"Baseline saved to {BASELINE_PATH}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions above {args.threshold}x")
+            sys.exit(1)
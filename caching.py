@@ -0,0 +1,161 @@
+# Memoización de las salidas de los callbacks y compresión de las respuestas de _dash-update-component.
+# Caché LRU en memoria por (función, argumentos, versión de los datos) y, opcionalmente,
+# en disco (data/cache/callbacks) para compartirla entre workers.
+import os
+import gzip
+import pickle
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+from flask import request
+import storage
+import metrics
+import background
+from model import dataset_version
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# CALLBACK_CACHE: "memory", "disk" (memoria + disco compartido) u "off"
+# Los callbacks en segundo plano se ejecutan en procesos hijos -> Por defecto en disco para compartir la caché
+CALLBACK_CACHE = os.environ.get("CALLBACK_CACHE", "disk" if background.manager is not None else "memory")
+CALLBACK_CACHE_SIZE = int(os.environ.get("CALLBACK_CACHE_SIZE", 256))
+CALLBACK_CACHE_DIR = "data/cache/callbacks"
+# Número máximo de archivos en disco, se borran los más antiguos
+CALLBACK_CACHE_FILES = int(os.environ.get("CALLBACK_CACHE_FILES", 2048))
+# COMPRESS=0 -> Respuestas sin comprimir; solo se comprimen las mayores de COMPRESS_MIN_SIZE bytes
+COMPRESS = os.environ.get("COMPRESS", "1") == "1"
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+COMPRESS_LEVEL = 6
+_cache = OrderedDict()
+_lock = threading.Lock()
+_writes = {"count": 0}
+
+RESPONSE_BYTES = metrics.counter("dash_response_bytes_total", "Bytes of the Dash callback responses before compression")
+COMPRESSED_BYTES = metrics.counter("dash_compressed_bytes_total", "Bytes of the Dash callback responses after compression")
+SAVED_BYTES = metrics.counter("dash_compression_saved_bytes_total", "Bytes saved by compressing the Dash callback responses")
+HIT_RATIO = metrics.gauge("cache_hit_ratio", "Hits over lookups of each cache since the process started")
+
+@metrics.collector
+def hit_ratios():
+    lookups = {}
+    for key, value in list(metrics.CACHE_REQUESTS.values.items()):
+        labels = dict(key)
+        hits, total = lookups.get(labels["cache"], (0, 0))
+        lookups[labels["cache"]] = (hits + value * (labels["result"] == "hit"), total + value)
+    for name, (hits, total) in lookups.items():
+        HIT_RATIO.set(round(hits / total, 4) if total else 0, cache = name)
+
+def data_version(datasets):
+    return "|".join(dataset_version(name) for name in datasets)
+
+def disk_path(key):
+    return os.path.join(CALLBACK_CACHE_DIR, f"{key}.pkl")
+
+def disk_get(key):
+    try:
+        with open(disk_path(key), "rb") as file:
+            return True, pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return False, None
+
+def disk_put(key, value):
+    os.makedirs(CALLBACK_CACHE_DIR, exist_ok = True)
+    tmp_path = storage.tmp_path(disk_path(key))
+    with open(tmp_path, "wb") as file:
+        pickle.dump(value, file, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, disk_path(key))
+    # Cada cierto número de escrituras se borran los archivos más antiguos
+    _writes["count"] += 1
+    if _writes["count"] % 64 == 0:
+        prune_disk()
+
+def prune_disk(limit = CALLBACK_CACHE_FILES):
+    paths = [os.path.join(CALLBACK_CACHE_DIR, name) for name in os.listdir(CALLBACK_CACHE_DIR) if name.endswith(".pkl")]
+    if len(paths) <= limit:
+        return
+    paths.sort(key = lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+    for path in paths[:len(paths) - limit]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def memoize(datasets = (), version = None):
+    """
+    Cache the result of a function of the callback inputs by its
+    arguments and the version of the datasets it reads (or the value
+    of version()). The result is shared: it must not be modified.
+    """
+    def decorator(function):
+        name = function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if CALLBACK_CACHE == "off":
+                return function(*args, **kwargs)
+            current = version() if version is not None else data_version(datasets)
+            key = hashlib.md5(repr((function.__module__, name, args, sorted(kwargs.items()), current)).encode()).hexdigest()
+            with _lock:
+                hit = key in _cache
+                if hit:
+                    _cache.move_to_end(key)
+                    value = _cache[key]
+            if not hit and CALLBACK_CACHE == "disk":
+                hit, value = disk_get(key)
+                if hit:
+                    store(key, value)
+            metrics.cache(f"callback:{name}", hit)
+            if hit:
+                return value
+            value = function(*args, **kwargs)
+            store(key, value)
+            if CALLBACK_CACHE == "disk":
+                disk_put(key, value)
+            return value
+        return wrapper
+    return decorator
+
+def store(key, value):
+    with _lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > CALLBACK_CACHE_SIZE:
+            _cache.popitem(last = False)
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+def encoding():
+    # Codificación aceptada por el navegador: brotli si está instalado, sino gzip
+    accepted = request.headers.get("Accept-Encoding", "")
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def compress_response(response):
+    if not COMPRESS or not request.path.endswith("_dash-update-component"):
+        return response
+    if response.direct_passthrough or response.status_code != 200 or "Content-Encoding" in response.headers:
+        return response
+    body = response.get_data()
+    method = encoding()
+    if method is None or len(body) < COMPRESS_MIN_SIZE:
+        return response
+    compressed = brotli.compress(body, quality = 5) if method == "br" else gzip.compress(body, compresslevel = COMPRESS_LEVEL)
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = method
+    response.headers["Vary"] = "Accept-Encoding"
+    RESPONSE_BYTES.inc(len(body))
+    COMPRESSED_BYTES.inc(len(compressed), encoding = method)
+    SAVED_BYTES.inc(len(body) - len(compressed))
+    return response
+
+def init_app(server):
+    # Flask ejecuta los after_request en orden inverso: las métricas registradas antes ven el tamaño comprimido
+    server.after_request(compress_response)
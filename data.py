@@ -1,137 +1,399 @@
+import os
 import json
+import time
+import threading
 import requests
+import numpy as np
 import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
-from utils import exists, calculate_tree_density, calculate_traffic
+import storage
+from utils import exists
+import metadata
+import metrics
+from spatial import calculate_features
+
+# Modo de refresco: "sync" (comprueba la API si ha caducado el TTL), 
+# "background" (sirve el archivo local y comprueba en segundo plano) u "offline"
+REFRESH_MODE = os.environ.get("REFRESH_MODE", "sync")
+FRESHNESS_PATH = "data/freshness.txt"
+DEFAULT_TTL = 86400
+_refreshing = set()
+_refresh_lock = threading.Lock()
+_freshness_lock = threading.Lock()
+API_URL = os.environ.get("API_URL", "https://valencia.opendatasoft.com/api/explore/v2.1/catalog/datasets")
+CHUNK_SIZE = 50000
+# Sesión HTTP compartida: conexiones reutilizadas, timeout y reintentos con backoff
+TIMEOUT = 30
+RETRIES = 3
+_session = {"session": None}
+WEATHER_POLLUTION_COLUMNS = {
+    "estacion": "station", "fecha": "date", "temperatura": "temperature", "humidad_relativa": "humidity",
+    "precipitacion": "rainfall", "velocidad_del_viento": "wind_speed", "no": "no", "no2": "no2",
+    "o3": "o3", "co": "co", "so2": "so2", "pm2_5": "pm2_5", "pm10": "pm10"
+}
+# Nombre de cada estación en weather-pollution
+STATION_NAMES = {
+    "Universidad Politécnica": "Politecnico",
+    "Boulevar Sur": "Bulevard Sud",
+    "Molí del Sol": "Moli del Sol",
+    "Viveros": "Viveros",
+    "Centro": "Valencia Centro",
+    "Olivereta": "Conselleria Meteo",
+    "Francia": "Avda. Francia",
+    "Pista de Silla": "Pista Silla",
+    "Dr. Lluch": "Puerto Valencia",
+    "Cabanyal": "Nazaret Meteo",
+    "Patraix": ""
+}
+# Tipos compactos por dataset: nombres de estación como categorías y medidas en float32
+# (las fechas ya son diarias y no hay un tipo de fecha más estrecho en pandas)
+MEASURES = ["temperature", "humidity", "rainfall", "wind_speed", "no", "no2", "o3", "co", "so2", "pm2_5", "pm10"]
+SCHEMAS = {
+    "weather-pollution": dict({"station": "category", "date": "datetime64[ns]"}, **{column: "float32" for column in MEASURES})
+}
+# Sincronización de weather-pollution: "full" (export completo) o "incremental" (solo filas nuevas)
+SYNC_MODE = os.environ.get("SYNC_MODE", "full")
+DATE_RANGE = ("2010-01-01", "2021-01-01")
+
+def get_session():
+    if _session["session"] is None:
+        session = requests.Session()
+        retry = Retry(total = RETRIES, backoff_factor = 0.5, status_forcelist = [429, 500, 502, 503, 504],
+                      allowed_methods = ["GET"])
+        adapter = HTTPAdapter(pool_connections = 8, pool_maxsize = 8, max_retries = retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session["session"] = session
+    return _session["session"]
 
 def get_json_data(id_name, type_request = "get"):
     # Descarga los datos y los devuelve
     if type_request == "get":
-        url = f"https://valencia.opendatasoft.com/api/explore/v2.1/catalog/datasets/{id_name}/exports/json?lang=es&timezone=Europe%2FBerlin"
+        url = f"{API_URL}/{id_name}/exports/json?lang=es&timezone=Europe%2FBerlin"
     elif type_request == "info":
-        url = f"https://valencia.opendatasoft.com/api/explore/v2.1/catalog/datasets/catalogo-de-datos-abiertos/records?select=modified&where=dataset_id%3D%22{id_name}%22&limit=20"
-    r = requests.get(url)
+        url = f"{API_URL}/catalogo-de-datos-abiertos/records?select=modified&where=dataset_id%3D%22{id_name}%22&limit=20"
+    start = time.perf_counter()
+    try:
+        r = get_session().get(url, timeout = TIMEOUT)
+    except requests.RequestException:
+        metrics.API_CALLS.inc(dataset = id_name, type = type_request, result = "error")
+        raise
+    metrics.API_LATENCY.observe(time.perf_counter() - start, type = type_request)
     if r.status_code == 200:
         data = json.loads(r.content)
+        metrics.API_CALLS.inc(dataset = id_name, type = type_request, result = "success")
     else:
+        metrics.API_CALLS.inc(dataset = id_name, type = type_request, result = "error")
         raise Exception("Only existing name can be used")
     return data
 
+def stream_csv_data(id_name, columns, chunksize = CHUNK_SIZE, where = None):
+    # Descarga el export CSV por bloques, leyendo solo las columnas necesarias
+    url = f"{API_URL}/{id_name}/exports/csv"
+    params = {"lang": "es", "timezone": "Europe/Berlin", "use_labels": "false", "delimiter": ";"}
+    if where is not None:
+        params["where"] = where
+    with get_session().get(url, params = params, stream = True, timeout = TIMEOUT) as r:
+        if r.status_code != 200:
+            metrics.API_CALLS.inc(dataset = id_name, type = "csv", result = "error")
+            raise Exception("Only existing name can be used")
+        metrics.API_CALLS.inc(dataset = id_name, type = "csv", result = "success")
+        r.raw.decode_content = True
+        for chunk in pd.read_csv(r.raw, sep = ";", usecols = columns, chunksize = chunksize):
+            yield chunk
+
+def apply_schema(name, data):
+    # Convierte solo las columnas que no tienen ya el tipo del esquema
+    schema = SCHEMAS.get(name, {})
+    dtypes = {column: dtype for column, dtype in schema.items() if column in data.columns and data[column].dtype != dtype}
+    return data.astype(dtypes) if dtypes else data
+
+def memory_usage(data):
+    # Bytes en memoria del DataFrame, incluidos los strings
+    return int(data.memory_usage(index = True, deep = True).sum())
+
+def preprocess_weather_pollution(data):
+    data = data[list(WEATHER_POLLUTION_COLUMNS)]
+    data.columns = list(WEATHER_POLLUTION_COLUMNS.values())
+    data["date"] = pd.to_datetime(data["date"])
+    data = data[data["date"] >= datetime.strptime(DATE_RANGE[0], "%Y-%m-%d")]
+    data = data[data["date"] < datetime.strptime(DATE_RANGE[1], "%Y-%m-%d")]
+    return apply_schema("weather-pollution", data)
+
+def load_freshness():
+    # Carga el TTL (segundos), la última comprobación y la fecha de la API de cada dataset
+    freshness = {}
+    if not os.path.exists(FRESHNESS_PATH):
+        return freshness
+    with open(FRESHNESS_PATH) as file:
+        for line in file.read().splitlines():
+            name, ttl, checked, api_date = line.split(",")
+            freshness[name] = [int(ttl), checked, api_date]
+    return freshness
+
+def update_freshness(name, api_last_update):
+    checked = datetime.strftime(datetime.now(), "%Y-%m-%dT%H:%M:%S")
+    with _freshness_lock:
+        freshness = load_freshness()
+        ttl = freshness.get(name, [DEFAULT_TTL])[0]
+        freshness[name] = [ttl, checked, datetime.strftime(api_last_update, "%Y-%m-%d")]
+        # Escribe en un temporal y lo renombra para no dejar el archivo a medias
+        txt = "\n".join(",".join([key] + [str(v) for v in values]) for key, values in freshness.items())
+        tmp_path = storage.tmp_path(FRESHNESS_PATH)
+        with open(tmp_path, "w") as file:
+            file.write(txt)
+        os.replace(tmp_path, FRESHNESS_PATH)
+
+def cached_update(name):
+    # Devuelve la fecha de la API guardada si no ha caducado, sino None
+    freshness = load_freshness()
+    if name not in freshness:
+        return None
+    ttl, checked, api_date = freshness[name]
+    if not checked:
+        return None
+    age = datetime.now() - datetime.strptime(checked, "%Y-%m-%dT%H:%M:%S")
+    if age.total_seconds() >= ttl:
+        return None
+    return datetime.strptime(api_date, "%Y-%m-%d")
+
 def last_update(info):
     id_name = info[1]
     if id_name in ["0", "1"]:
         return datetime.strptime(info[2], "%Y-%m-%d")
+    # Si se ha comprobado hace menos del TTL -> no consulta la API
+    date = cached_update(info[0])
+    metrics.cache("freshness", date is not None)
+    if date is not None:
+        return date
     # Devuelve la fecha de actualización
     info_data = get_json_data(id_name, "info")
     date = info_data["results"][0]["modified"]
     date = date.split("T")[0]
     date = datetime.strptime(date, "%Y-%m-%d")
+    update_freshness(info[0], date)
     return date
 
-def update_metadata(info, api_last_update):
-    date = datetime.strftime(api_last_update, "%Y-%m-%d")
-    id_name = info[1]
-    # Actualizar Archimo metadatos
-    with open("data/metadata.txt", "r") as file:
-        upt_info = []
-        for line in file.read().splitlines():
-            line = line.split(",")
-            if line[1] == id_name:
-                line[2] = date
-            if line[0] in ["model", "month-weather"]:
-                line[1] = "0"
-            upt_info.append(",".join(line)) 
-    with open("data/metadata.txt", "w") as file:
-        txt = "\n".join(upt_info)
-        file.write(txt)
-
 def update_data(data, path):
-    data.to_json(path, indent = 4, orient = "records")
+    storage.write(data, path)
 
 def load_data(info):
     # Carga los datos y los devuelve 
     path = info[3]
-    data = pd.read_json(path)
+    start = time.perf_counter()
+    data = apply_schema(info[0], storage.read(path))
+    duration = time.perf_counter() - start
+    metadata.record_load(info[0], duration, len(data))
+    metrics.DATASET_LOAD.observe(duration, dataset = info[0])
     return data
 
+def incremental_where(local):
+    # Filas posteriores a la última fecha local de cada estación, más las estaciones nuevas
+    last_dates = local.groupby("station", observed = True)["date"].max()
+    clauses = [f'(estacion = "{station}" AND fecha > date\'{date:%Y-%m-%d}\')' for station, date in last_dates.items()]
+    if len(last_dates):
+        clauses.append("NOT (" + " OR ".join(f'estacion = "{station}"' for station in last_dates.index) + ")")
+    where = " OR ".join(clauses)
+    return f"({where}) AND fecha >= date'{DATE_RANGE[0]}' AND fecha < date'{DATE_RANGE[1]}'"
+
+def update_aggregates(data, new_rows):
+    # Recalcula solo las medias que dependen de las filas nuevas
+    status, info = exists("stations")
+    if status and storage.exists(info[3]):
+        stations = load_data(info)
+        changed = stations["name"].map(STATION_NAMES).isin(new_rows["station"].unique())
+        if changed.any():
+            means = data[data["station"].isin(new_rows["station"].unique())].groupby("station", observed = True)[["co", "so2", "pm2_5"]].mean()
+            means.columns = ["co", "so2", "pm"]
+            for column in means.columns:
+                stations.loc[changed, column] = stations.loc[changed, "name"].map(STATION_NAMES).map(means[column]).to_numpy()
+            update_data(stations, info[3])
+            # Misma fecha de la API: solo cambian las medias (hash, filas y los derivados como desactualizados)
+            metadata.record_update("stations", datetime.strptime(info[2], "%Y-%m-%d"), stations)
+    status, info = exists("month-weather")
+    if status and storage.exists(info[3]):
+        month_weather = load_data(info)
+        months = new_rows["date"].dt.month.unique()
+        columns = [column for column in month_weather.columns if column != "month"]
+        affected = data[data["date"].dt.month.isin(months)]
+        means = affected.groupby(affected["date"].dt.month)[columns].mean()
+        month_weather = month_weather.set_index("month")
+        for month in means.index:
+            month_weather.loc[month, columns] = means.loc[month, columns].to_numpy()
+        update_data(month_weather.reset_index(), info[3])
+        metadata.record_update("month-weather", data = month_weather)
+
+def sync_data(info, api_last_update):
+    # Descarga solo las filas nuevas, las añade y elimina duplicados por (station, date)
+    local = load_data(info)
+    columns = list(WEATHER_POLLUTION_COLUMNS)
+    chunks = [preprocess_weather_pollution(chunk) for chunk in stream_csv_data(info[1], columns, where = incremental_where(local))]
+    new_rows = pd.concat(chunks) if chunks else local.iloc[:0]
+    print(f"{len(new_rows)} new rows for {info[0]} database")
+    if new_rows.empty:
+        metadata.record_update(info[0], api_last_update, local)
+        return apply_schema(info[0], local)
+    data = pd.concat([local, new_rows], ignore_index = True)
+    data = data.drop_duplicates(["station", "date"], keep = "last").sort_values(["station", "date"], ignore_index = True)
+    update_data(data, info[3])
+    metadata.record_update(info[0], api_last_update, data)
+    update_aggregates(data, new_rows)
+    return apply_schema(info[0], data)
+
+def extract_points(points):
+    # geo_point_2d ({"lon": ..., "lat": ...}) -> Columnas lon y lat de una vez
+    records = [point if isinstance(point, dict) else {} for point in points.tolist()]
+    return pd.DataFrame.from_records(records, columns = ["lon", "lat"], index = points.index)
+
+def preprocess_trees(data_raw, precision = 3):
+    # Número de árboles por celda de 10^-precision grados (coordenadas redondeadas)
+    coords = extract_points(data_raw["geo_point_2d"])
+    scale = 10 ** precision
+    # Enteros de la malla: mismo redondeo que Series.round(precision)
+    ix = np.rint(coords["lon"].to_numpy(dtype = float) * scale)
+    iy = np.rint(coords["lat"].to_numpy(dtype = float) * scale)
+    valid = np.isfinite(ix) & np.isfinite(iy)
+    named = data_raw["nom_comu_c"].notna().to_numpy()[valid]
+    ix, iy = ix[valid].astype(np.int64), iy[valid].astype(np.int64)
+    if len(ix) == 0:
+        return pd.DataFrame({"lon": [], "lat": [], "n": []})
+    # Una clave por celda, ordenada por lon y luego lat
+    width = iy.max() - iy.min() + 1
+    key = (ix - ix.min()) * width + (iy - iy.min())
+    cells, inverse = np.unique(key, return_inverse = True)
+    counts = np.bincount(inverse, weights = named, minlength = len(cells)).astype(np.int64)
+    return pd.DataFrame({"lon": (cells // width + ix.min()) / scale, "lat": (cells % width + iy.min()) / scale, "n": counts})
+
+def preprocess_traffic(data_raw):
+    data = data_raw[["idtramo", "des_tramo", "lectura", "geo_shape"]].copy()
+    data.columns = ["id", "name", "cars_per_hour", "geo_shape"]
+    return data
+
+def station_means(names, weather_pollution):
+    # Media de cada contaminante por estación con un único groupby
+    means = weather_pollution.groupby("station", observed = True)[["co", "so2", "pm2_5"]].mean()
+    unknown = [name for name in names if name not in STATION_NAMES]
+    if unknown:
+        raise Exception(f"Unknown stations: {unknown}")
+    means = means.reindex([STATION_NAMES[name] for name in names])
+    means.columns = ["co", "so2", "pm"]
+    return means.reset_index(drop = True)
+
+def station_features(data, trees, traffic, weather_pollution):
+    # Densidad de árboles y tráfico de todas las estaciones en una llamada, y medias de contaminantes
+    features = calculate_features(data["lon"], data["lat"], trees, traffic)
+    means = station_means(data["name"].tolist(), weather_pollution)
+    data["cars_per_day"] = features["cars_per_day"].round().astype("int64").to_numpy()
+    data["trees"] = features["trees"].to_numpy()
+    for column in ["co", "so2", "pm"]:
+        data[column] = means[column].to_numpy()
+    return data
+
+def preprocess_stations(data_raw, trees, traffic, weather_pollution):
+    coords = extract_points(data_raw["geo_point_2d"])
+    data = pd.DataFrame({"name": data_raw["nombre"], "lon": coords["lon"], "lat": coords["lat"]})
+    return station_features(data, trees, traffic, weather_pollution)
+
+def update_stations():
+    # Recalcula las variables de las estaciones locales cuando cambian sus dependencias (sin descargarlas)
+    status, info = exists("stations")
+    stations = station_features(load_data(info).copy(), get_data("trees"), get_data("traffic"), get_data("weather-pollution"))
+    update_data(stations, info[3])
+    # Misma fecha de la API: la de las estaciones no ha cambiado
+    metadata.record_update("stations", datetime.strptime(info[2], "%Y-%m-%d"), stations)
+    return stations
+
 def download_data(info, api_last_update):
+    # Descarga, preprocesa y guarda el dataset, midiendo la duración y el resultado
+    start = time.perf_counter()
+    try:
+        data = fetch_data(info, api_last_update)
+    except Exception:
+        metrics.DATASET_REFRESH_TOTAL.inc(dataset = info[0], result = "failure")
+        raise
+    metrics.DATASET_REFRESH.observe(time.perf_counter() - start, dataset = info[0])
+    metrics.DATASET_REFRESH_TOTAL.inc(dataset = info[0], result = "success")
+    return data
+
+def fetch_data(info, api_last_update):
     id_name = info[1]
+    if info[0] == "weather-pollution" and SYNC_MODE == "incremental" and storage.exists(info[3]):
+        return sync_data(info, api_last_update)
+    # Datos grandes -> Descargar, preprocesar y guardar por bloques
+    if info[0] == "weather-pollution":
+        columns = list(WEATHER_POLLUTION_COLUMNS)
+        chunks = (preprocess_weather_pollution(chunk) for chunk in stream_csv_data(id_name, columns))
+        storage.write_chunks(chunks, info[3])
+        data = load_data(info)
+        metadata.record_update(info[0], api_last_update, data)
+        return data
     # Descargar 
     data_json_raw = get_json_data(id_name)
     data_raw = pd.DataFrame.from_dict(data_json_raw)
     # Preprocesar
     if info[0] == "trees":
-        data = data_raw[["nom_comu_c"]]
-        data["lon"]  = data_raw["geo_point_2d"].apply(lambda x: dict(x)["lon"])
-        data["lat"]  = data_raw["geo_point_2d"].apply(lambda x: dict(x)["lat"])
-        data["lon"] = data["lon"].round(3)
-        data["lat"] = data["lat"].round(3)
-        data = data.groupby(["lon", "lat"]).count().reset_index()
-        data = data[["lon", "lat", "nom_comu_c"]]
-        data.columns = ["lon", "lat", "n"]
+        data = preprocess_trees(data_raw)
     elif info[0] == "traffic":
-        data = data_raw[["idtramo", "des_tramo", "lectura", "geo_shape"]]
-        data.columns = ["id", "name", "cars_per_hour", "geo_shape"]
-    elif info[0] == "weather-pollution":
-        data = data_raw[["estacion", "fecha", "temperatura", "humidad_relativa", "precipitacion", 
-                   "velocidad_del_viento", "no", "no2", "o3", "co", "so2", "pm2_5", "pm10"]]
-        data.columns = ["station", "date", "temperature", "humidity", "rainfall", "wind_speed",
-                 "no", "no2", "o3", "co", "so2", "pm2_5", "pm10"]
-        data["date"] = pd.to_datetime(data["date"])
-        data = data[data["date"] >= datetime.strptime("2010-01-01", "%Y-%m-%d")]
-        data = data[data["date"] < datetime.strptime("2021-01-01", "%Y-%m-%d")]
+        data = preprocess_traffic(data_raw)
     elif info[0] == "stations":
-        trees = get_data("trees")
-        traffic = get_data("traffic")
-        weather_pollution = get_data("weather-pollution")
-        data = data_raw[["nombre"]]
-        data["lon"]  = data_raw["geo_point_2d"].apply(lambda x: dict(x)["lon"])
-        data["lat"]  = data_raw["geo_point_2d"].apply(lambda x: dict(x)["lat"])
-        data.columns = ["name", "lon", "lat"]
-        tree_dens = []
-        cars_day = []
-        co = []
-        so2 = []
-        pm = []
-        for name in data["name"].unique():
-            dens = calculate_tree_density(data, trees, name)
-            cars = calculate_traffic(data, traffic, name)
-            names = {
-                "Universidad Politécnica": "Politecnico",
-                "Boulevar Sur": "Bulevard Sud",
-                "Molí del Sol": "Moli del Sol",
-                "Viveros": "Viveros",
-                "Centro": "Valencia Centro",
-                "Olivereta": "Conselleria Meteo",
-                "Francia": "Avda. Francia",
-                "Pista de Silla": "Pista Silla",
-                "Dr. Lluch": "Puerto Valencia",
-                "Cabanyal": "Nazaret Meteo",
-                "Patraix": ""
-            }   
-            station_data = weather_pollution[weather_pollution["station"] == names[name]]
-            tree_dens.append(dens)
-            cars_day.append(cars)
-            co.append(station_data["co"].mean())
-            so2.append(station_data["so2"].mean())
-            pm.append(station_data["pm2_5"].mean())
-        data["cars_per_day"] = cars_day
-        data["trees"] = tree_dens
-        data["co"] = co
-        data["so2"] = so2
-        data["pm"] = pm
+        data = preprocess_stations(data_raw, get_data("trees"), get_data("traffic"), get_data("weather-pollution"))
     # Actualizar datos y metadatos
     update_data(data, info[3])
-    update_metadata(info, api_last_update)
+    metadata.record_update(info[0], api_last_update, data)
     # Devolver datos
     return data
 
+def refresh_data(info):
+    name = info[0]
+    try:
+        api_last_update = last_update(info)
+        local_last_update = datetime.strptime(info[2], "%Y-%m-%d")
+        if local_last_update != api_last_update:
+            print(f"Updating {name} database in background...")
+            download_data(info, api_last_update)
+            # Importado aquí: timeseries y shared importan este módulo
+            import timeseries
+            timeseries.republish()
+    except Exception as e:
+        print(f"Background update of {name} database failed: {e}")
+    finally:
+        with _refresh_lock:
+            _refreshing.discard(name)
+
+def refresh_background(info):
+    # Lanza la comprobación en segundo plano si no hay otra en curso
+    name = info[0]
+    with _refresh_lock:
+        if name in _refreshing:
+            return
+        _refreshing.add(name)
+    thread = threading.Thread(target = refresh_data, args = (info,), daemon = True)
+    thread.start()
+
 def get_data(name):
     status, info = exists(name)
     # Comprobar si existe
     if not status:
         raise Exception("The database does not exist")
-    api_last_update = last_update(info)
+    local_exists = storage.exists(info[3])
+    # Sin red -> Cargar el archivo local
+    if REFRESH_MODE == "offline":
+        if not local_exists:
+            raise Exception(f"The database {name} is not available offline")
+        return load_data(info)
+    # Stale-while-revalidate -> Cargar el archivo local y comprobar en segundo plano
+    if REFRESH_MODE == "background" and local_exists:
+        refresh_background(info)
+        return load_data(info)
+    try:
+        api_last_update = last_update(info)
+    except requests.RequestException as e:
+        if not local_exists:
+            raise
+        print(f"Could not check {name} database ({e}), using local copy...")
+        return load_data(info)
     local_last_update = info[2]
     local_last_update = datetime.strptime(local_last_update, "%Y-%m-%d")
 
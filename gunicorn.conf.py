@@ -0,0 +1,47 @@
+# Configuración de Gunicorn. Uso (desde la raíz del proyecto): gunicorn -c gunicorn.conf.py index:server
+# El master publica una instantánea inmutable de los datos (ver shared.py) y los workers la abren memory-mapped.
+import os
+import traceback
+import shared
+import startup
+import timeseries
+
+bind = os.environ.get("BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+timeout = 120
+# La aplicación se importa una vez en el master y los workers la heredan al hacer fork
+preload_app = True
+# Los workers adoptan las nuevas instantáneas (refresh.py o la actualización en segundo plano vuelven
+# a publicar) y comprueban en cada acceso que no estén desactualizadas; se reciclan para liberar memoria
+max_requests = int(os.environ.get("MAX_REQUESTS", 5000))
+max_requests_jitter = max_requests // 10
+RSS_LOG_EVERY = int(os.environ.get("RSS_LOG_EVERY", 500))
+
+def rss(usage):
+    return ", ".join(f"{key} {value / 1024:.1f} MB" for key, value in usage.items() if key != "pid")
+
+# Con preload_app la aplicación se carga antes de on_starting -> se publica al leer la configuración
+# Si falla (p.ej. sin datos ni red) el servidor arranca igual: cada worker carga sus datos con get_data
+try:
+    snapshot, snapshot_error = timeseries.publish_stores(), None
+except Exception:
+    snapshot, snapshot_error = None, traceback.format_exc()
+
+def on_starting(server):
+    if snapshot_error is not None:
+        server.log.error(f"Shared snapshot not published, workers load their own data:\n{snapshot_error}")
+    server.log.info(f"Shared snapshot {snapshot}, master RSS: {rss(shared.memory_usage())}")
+
+def post_fork(server, worker):
+    worker.log.info(f"Worker {worker.pid} forked, RSS: {rss(shared.memory_usage())}")
+
+def post_worker_init(worker):
+    worker.log.info(f"Worker {worker.pid} ready, RSS: {rss(shared.memory_usage())}")
+    # Cada worker precarga las páginas en segundo plano mientras ya atiende peticiones
+    if startup.WARM_UP:
+        import index
+        index.warm_up()
+
+def post_request(worker, req, environ, resp):
+    if worker.nr % RSS_LOG_EVERY == 0:
+        worker.log.info(f"Worker {worker.pid} after {worker.nr} requests, RSS: {rss(shared.memory_usage())}")
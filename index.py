@@ -1,13 +1,29 @@
-from dash import html, dcc
-from dash.dependencies import Input, Output
-from pages.home import create_page_home
-from pages.microclimates import create_page_microclimates
-from pages.future import create_page_future
+import startup
+with startup.phase("import dash"):
+    from dash import html, dcc
+    from dash.dependencies import Input, Output
+    from flask import jsonify
+    from app import app
+    import metrics
+    import caching
+# Las páginas registran sus callbacks al importarse, sus datos se cargan después
+with startup.phase("import pages.home"):
+    import pages.home
+    from pages.home import create_page_home
+with startup.phase("import pages.microclimates"):
+    import pages.microclimates
+    from pages.microclimates import create_page_microclimates
+with startup.phase("import pages.future"):
+    import pages.future
+    from pages.future import create_page_future
 from pages.error import create_page_error
-from app import app
 
 server = app.server
 app.config.suppress_callback_exceptions = True
+# Latencia y tamaño de cada callback, y /metrics para Prometheus
+metrics.init_app(server)
+# Compresión de las respuestas de los callbacks
+caching.init_app(server)
 
 app.layout = html.Div([
     dcc.Location(id='url', refresh=False),
@@ -26,5 +42,20 @@ def display_page(pathname):
     else:
         return create_page_error()
 
+@server.route("/startup")
+def startup_times():
+    # Tiempos de arranque por fase, para seguir las regresiones del arranque en frío
+    return jsonify(startup.timings)
+
+def warm_up(background = True):
+    # Carga los datos de cada página, en orden, mientras el servidor ya responde
+    return startup.warm_up({
+        "data pages.home": pages.home.warm_up,
+        "data pages.microclimates": pages.microclimates.warm_up,
+        "model pages.future": pages.future.warm_up
+    }, background)
+
 if __name__ == '__main__':
+    if startup.WARM_UP:
+        warm_up()
     app.run_server(debug=False)
@@ -0,0 +1,175 @@
+# Inferencia de los MLP sin scikit-learn: pesos en un .npz sin comprimir (memory-mapped)
+# y una única pasada hacia delante, por lotes, para todos los contaminantes.
+import os
+import zipfile
+import numpy as np
+import storage
+
+# Activaciones en el sitio, como en scikit-learn
+ACTIVATIONS = {
+    "identity": lambda x: x,
+    "tanh": lambda x: np.tanh(x, out = x),
+    "logistic": lambda x: np.reciprocal(np.add(np.exp(np.negative(x, out = x), out = x), 1, out = x), out = x),
+    "relu": lambda x: np.maximum(x, 0, out = x)
+}
+# Entradas de comprobación y tolerancia frente a las salidas de scikit-learn
+PROBE_SIZE = 64
+RTOL = 1e-6
+ATOL = 1e-8
+
+def networks(models):
+    # Redes distintas (un modelo multi-salida se comparte entre contaminantes) y columna de cada etiqueta
+    nets = []
+    columns = {}
+    offsets = {}
+    for label, model in models.items():
+        net, index = (model.model, model.index) if hasattr(model, "index") else (model, 0)
+        if id(net) not in offsets:
+            offsets[id(net)] = sum(n.coefs_[-1].shape[1] for n in nets)
+            nets.append(net)
+        columns[label] = offsets[id(net)] + index
+    return nets, columns
+
+def fuse(nets):
+    """
+    Stack the networks into one: the first layer is concatenated (same
+    inputs) and the rest are block diagonal, so every output comes out
+    of a single chain of matrix products. All the networks must have
+    the same depth and activations.
+    """
+    depth = len(nets[0].coefs_)
+    coefs = [np.hstack([net.coefs_[0] for net in nets])]
+    for layer in range(1, depth):
+        blocks = [net.coefs_[layer] for net in nets]
+        fused = np.zeros((sum(b.shape[0] for b in blocks), sum(b.shape[1] for b in blocks)))
+        row, col = 0, 0
+        for block in blocks:
+            fused[row:row + block.shape[0], col:col + block.shape[1]] = block
+            row, col = row + block.shape[0], col + block.shape[1]
+        coefs.append(fused)
+    intercepts = [np.concatenate([net.intercepts_[layer] for net in nets]) for layer in range(depth)]
+    return coefs, intercepts
+
+def probe_inputs(n_features, n = PROBE_SIZE):
+    # Entradas fijas en el rango de las variables (clima, coches y árboles)
+    rng = np.random.default_rng(0)
+    scale = np.array([30, 20, 10, 500000, 3000][:n_features] + [1] * max(0, n_features - 5), dtype = float)
+    return rng.random((n, n_features)) * scale
+
+def export_models(models, path, version):
+    """
+    Save the weights of the MLPs as plain arrays, together with probe
+    inputs and the scikit-learn outputs for them
+    """
+    nets, columns = networks(models)
+    if any(net.activation != nets[0].activation or len(net.coefs_) != len(nets[0].coefs_) for net in nets):
+        raise Exception("The networks can not be fused: different activations or depths")
+    coefs, intercepts = fuse(nets)
+    labels = list(columns)
+    X = probe_inputs(coefs[0].shape[0])
+    expected = np.column_stack([models[label].predict(X) for label in labels])
+    arrays = {f"coef_{i}": c for i, c in enumerate(coefs)}
+    arrays.update({f"intercept_{i}": b for i, b in enumerate(intercepts)})
+    arrays.update(labels = np.array(labels), columns = np.array([columns[label] for label in labels]),
+                  activation = np.array(nets[0].activation), out_activation = np.array(nets[0].out_activation_),
+                  probe_X = X, probe_y = expected, version = np.array(version))
+    tmp_path = storage.tmp_path(path, ".tmp.npz")
+    # Sin comprimir -> Cada array se puede abrir memory-mapped
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+def load_npz(path):
+    # np.load no hace memory-map de los .npz: se localiza cada .npy dentro del zip y se abre con np.memmap
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as file:
+        for member in archive.infolist():
+            if member.compress_type != zipfile.ZIP_STORED:
+                raise Exception(f"{member.filename} in {path} is compressed")
+            # Cabecera local del zip: 30 bytes + nombre + campo extra
+            file.seek(member.header_offset + 26)
+            name_length, extra_length = np.frombuffer(file.read(4), dtype = "<u2")
+            file.seek(member.header_offset + 30 + name_length + extra_length)
+            major, minor = np.lib.format.read_magic(file)
+            read_header = np.lib.format.read_array_header_1_0 if major == 1 else np.lib.format.read_array_header_2_0
+            shape, fortran, dtype = read_header(file)
+            key = member.filename[:-4]
+            if dtype.hasobject:
+                raise Exception(f"{key} in {path} is not a plain array")
+            if len(shape) == 0 or 0 in shape:
+                arrays[key] = np.fromfile(file, dtype = dtype, count = int(np.prod(shape))).reshape(shape)
+            else:
+                arrays[key] = np.memmap(path, dtype = dtype, mode = "r", offset = file.tell(), shape = shape,
+                                        order = "F" if fortran else "C")
+    return arrays
+
+class FusedMLP:
+    """
+    All the pollutant networks as one: predict(X) returns an array with
+    one column per label. It also behaves like the dict of models
+    (keys, items, len) used by the rest of model.py.
+    """
+    def __init__(self, arrays):
+        depth = len([key for key in arrays if key.startswith("coef_")])
+        # np.asarray -> ndarray sobre el mismo memory map, sin la sobrecarga de np.memmap en cada operación
+        self.coefs = [np.asarray(arrays[f"coef_{i}"]) for i in range(depth)]
+        self.intercepts = [np.asarray(arrays[f"intercept_{i}"]) for i in range(depth)]
+        self.labels = [str(label) for label in arrays["labels"]]
+        self.columns = np.asarray(arrays["columns"])
+        self.activation = ACTIVATIONS[str(arrays["activation"])]
+        self.out_activation = ACTIVATIONS[str(arrays["out_activation"])]
+        self.version = str(arrays["version"])
+        self.arrays = arrays
+
+    def predict(self, X):
+        h = np.asarray(X, dtype = float)
+        for layer, (coef, intercept) in enumerate(zip(self.coefs, self.intercepts)):
+            h = h @ coef
+            h += intercept
+            h = self.activation(h) if layer < len(self.coefs) - 1 else self.out_activation(h)
+        return h[:, self.columns]
+
+    def verify(self):
+        # Las salidas tienen que coincidir con las de scikit-learn guardadas al exportar
+        return np.allclose(self.predict(self.arrays["probe_X"]), self.arrays["probe_y"], rtol = RTOL, atol = ATOL)
+
+    def keys(self):
+        return self.labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def __getitem__(self, label):
+        return LabelModel(self, self.labels.index(label))
+
+    def items(self):
+        return [(label, self[label]) for label in self.labels]
+
+class LabelModel:
+    # Un contaminante de FusedMLP, con la interfaz predict de scikit-learn
+    def __init__(self, fused, index):
+        self.fused = fused
+        self.index = index
+
+    def predict(self, X):
+        return self.fused.predict(X)[:, self.index]
+
+def load_fused(path, version = None):
+    # FusedMLP si el archivo existe, es de esta versión y coincide con scikit-learn, sino None
+    if not os.path.exists(path):
+        return None
+    fused = FusedMLP(load_npz(path))
+    if version is not None and fused.version != version:
+        return None
+    if not fused.verify():
+        print(f"The exported model in {path} does not match scikit-learn, ignoring it")
+        return None
+    return fused
+
+def predict_all(models, X):
+    # Predicciones de todos los modelos, una fila por modelo
+    if isinstance(models, FusedMLP):
+        return models.predict(X).T
+    return np.stack([model.predict(X) for model in models.values()])
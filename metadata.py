@@ -0,0 +1,167 @@
+# Registro de datasets: data/metadata.txt (name,id,date,path,deps) y estadísticas en data/metadata-stats.json
+# Lecturas desde un índice en memoria que se invalida cuando cambia el archivo;
+# escrituras atómicas (temporal + rename) bajo un bloqueo entre procesos.
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import storage
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+METADATA_PATH = "data/metadata.txt"
+STATS_PATH = "data/metadata-stats.json"
+LOCK_PATH = "data/metadata.lock"
+# Los tiempos de carga se guardan en disco como mucho cada STATS_FLUSH segundos
+STATS_FLUSH = 60
+_index = {"key": None, "entries": {}}
+_stats = {"loads": {}, "flushed": 0}
+_lock = threading.RLock()
+
+def file_key(path):
+    # Cambia con cada escritura: os.replace crea un archivo nuevo
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def parse(text):
+    return {line.split(",")[0]: line.split(",") for line in text.splitlines() if line}
+
+def entries():
+    # Vuelve a leer metadata.txt solo si ha cambiado desde la última lectura
+    key = file_key(METADATA_PATH)
+    with _lock:
+        if _index["key"] != key:
+            with open(METADATA_PATH) as file:
+                _index["entries"] = parse(file.read())
+            _index["key"] = key
+        return _index["entries"]
+
+def get(name):
+    # (True, info) si existe el dataset, sino (False, [])
+    info = entries().get(name)
+    return (True, list(info)) if info is not None else (False, [])
+
+def graph():
+    # Quinta columna: dependencias separadas por ";"
+    return {name: [dep for dep in info[4].split(";") if dep] if len(info) > 4 else []
+            for name, info in entries().items()}
+
+def dependents(graph, name):
+    # Datasets que dependen (directa o indirectamente) de name
+    found = set()
+    pending = [name]
+    while pending:
+        current = pending.pop()
+        for other, deps in graph.items():
+            if current in deps and other not in found:
+                found.add(other)
+                pending.append(other)
+    return found
+
+@contextmanager
+def locked():
+    # Bloqueo entre hilos y entre procesos (flock sobre LOCK_PATH, se libera si el proceso muere)
+    with _lock:
+        with open(LOCK_PATH, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+def write_atomic(path, text):
+    tmp_path = storage.tmp_path(path)
+    with open(tmp_path, "w") as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+def read_stats():
+    if not os.path.exists(STATS_PATH):
+        return {}
+    with open(STATS_PATH) as file:
+        return json.load(file)
+
+def content_hash(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+def local_path(info):
+    # Archivo en el backend de almacenamiento, o la ruta tal cual (p.ej. model.sav)
+    path = storage.backend_path(info[3], storage.get_backend())
+    return path if os.path.exists(path) else info[3]
+
+def record_update(name, date = None, data = None):
+    """
+    Set the update date of a dataset (and mark it as updated if it is
+    derived), mark its dependents as stale and record the hash and row
+    count of the new file
+    """
+    date = datetime.strftime(date or datetime.today(), "%Y-%m-%d")
+    with locked():
+        # Se relee bajo el bloqueo para no perder escrituras de otros procesos
+        _index["key"] = None
+        current = entries()
+        if name not in current:
+            raise Exception(f"The database {name} does not exist")
+        stale = dependents(graph(), name)
+        lines = []
+        for other, info in current.items():
+            info = list(info)
+            if other == name:
+                info[2] = date
+                if info[1] in ["0", "1"]:
+                    info[1] = "1"
+            elif other in stale and info[1] in ["0", "1"]:
+                info[1] = "0"
+            lines.append(",".join(info))
+        write_atomic(METADATA_PATH, "\n".join(lines))
+        path = local_path(current[name])
+        stats = read_stats()
+        stats[name] = dict(stats.get(name, {}),
+                           hash = content_hash(path) if os.path.exists(path) else None,
+                           rows = len(data) if data is not None else None,
+                           bytes = os.path.getsize(path) if os.path.exists(path) else None,
+                           updated = date)
+        write_atomic(STATS_PATH, json.dumps(stats, indent = 4))
+
+def record_load(name, seconds, rows = None):
+    # Tiempos de carga en memoria, se guardan en disco de vez en cuando
+    with _lock:
+        load = _stats["loads"].setdefault(name, {"loads": 0, "total_ms": 0})
+        load["loads"] += 1
+        load["total_ms"] += seconds * 1000
+        load["last_ms"] = round(seconds * 1000, 2)
+        if rows is not None:
+            load["rows"] = rows
+        if time.time() - _stats["flushed"] > STATS_FLUSH:
+            flush_stats()
+
+def flush_stats():
+    with locked():
+        stats = read_stats()
+        for name, load in _stats["loads"].items():
+            stats[name] = dict(stats.get(name, {}), load_ms = round(load["total_ms"] / load["loads"], 2),
+                               last_load_ms = load["last_ms"])
+            if "rows" in load:
+                stats[name]["rows"] = load["rows"]
+        write_atomic(STATS_PATH, json.dumps(stats, indent = 4))
+        _stats["flushed"] = time.time()
+
+def stats(name = None):
+    # Estadísticas guardadas más los tiempos de carga de este proceso
+    saved = read_stats()
+    with _lock:
+        for other, load in _stats["loads"].items():
+            saved[other] = dict(saved.get(other, {}), load_ms = round(load["total_ms"] / load["loads"], 2),
+                                last_load_ms = load["last_ms"])
+    return saved.get(name, {}) if name is not None else saved
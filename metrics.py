@@ -0,0 +1,223 @@
+# Métricas del servidor en formato de texto de Prometheus (/metrics) y perfilado opcional de peticiones lentas.
+# Cada proceso (worker) tiene sus propias métricas.
+import os
+import sys
+import time
+import threading
+from collections import Counter as Tally
+from flask import request, g, Response
+
+# PROFILE=1 -> Muestrea la pila de cada petición y guarda las que tardan más de PROFILE_SLOW_MS en PROFILE_DIR
+PROFILE = os.environ.get("PROFILE", "0") == "1"
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 500))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000
+PROFILE_DIR = "data/profiles"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7)
+_registry = {}
+_collectors = []
+_lock = threading.Lock()
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def format_labels(key, extra = ()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, value = 1, **labels):
+        key = label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self):
+        return [(self.name, key, (), value) for key, value in self.values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[label_key(labels)] = value
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        with _lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))[:2]
+            counts = [c + (value <= bound) for c, bound in zip(counts, self.buckets)]
+            n = self.values.get(key, (None, None, 0))[2] + 1
+            self.values[key] = (counts, total + value, n)
+
+    def samples(self):
+        samples = []
+        for key, (counts, total, n) in self.values.items():
+            for bound, count in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", key, (("le", f"{bound:g}"),), count))
+            samples.append((f"{self.name}_bucket", key, (("le", "+Inf"),), n))
+            samples.append((f"{self.name}_sum", key, (), total))
+            samples.append((f"{self.name}_count", key, (), n))
+        return samples
+
+def register(metric):
+    return _registry.setdefault(metric.name, metric)
+
+def counter(name, help):
+    return register(Counter(name, help))
+
+def gauge(name, help):
+    return register(Gauge(name, help))
+
+def histogram(name, help, buckets = LATENCY_BUCKETS):
+    return register(Histogram(name, help, buckets))
+
+def collector(function):
+    # Función que actualiza métricas justo antes de cada lectura de /metrics
+    _collectors.append(function)
+    return function
+
+CALLBACK_LATENCY = histogram("dash_callback_duration_seconds", "Latency of Dash callback requests by output")
+CALLBACK_SIZE = histogram("dash_callback_response_bytes", "Size of Dash callback responses by output", SIZE_BUCKETS)
+CALLBACK_ERRORS = counter("dash_callback_errors_total", "Dash callback requests with an error status by output")
+HTTP_LATENCY = histogram("http_request_duration_seconds", "Latency of the other HTTP requests by route")
+DATASET_LOAD = histogram("dataset_load_seconds", "Time to load a dataset from local storage")
+DATASET_REFRESH = histogram("dataset_refresh_seconds", "Time to download and preprocess a dataset")
+DATASET_REFRESH_TOTAL = counter("dataset_refresh_total", "Dataset refreshes by result")
+API_CALLS = counter("api_requests_total", "Requests to the open data API by dataset, type and result")
+API_LATENCY = histogram("api_request_duration_seconds", "Latency of the open data API requests")
+CACHE_REQUESTS = counter("cache_requests_total", "Cache lookups by cache and result (hit or miss)")
+TRAINING_SECONDS = gauge("model_training_seconds", "Duration of the last model training by target")
+TRAINING_RUNNING = gauge("model_training_running", "1 while a model training is running")
+PROFILES = counter("profiles_written_total", "Slow request profiles written")
+
+def cache(name, hit):
+    CACHE_REQUESTS.inc(cache = name, result = "hit" if hit else "miss")
+
+def timed(histogram, **labels):
+    # Context manager: observa la duración del bloque
+    return _Timer(histogram, labels)
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+def render():
+    for function in _collectors:
+        try:
+            function()
+        except Exception as e:
+            print(f"Metrics collector {function.__name__} failed: {e}")
+    lines = []
+    with _lock:
+        for metric in _registry.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{format_labels(key, extra)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+class Sampler:
+    """
+    Samples the stack of one thread every PROFILE_INTERVAL seconds and
+    counts the collapsed stacks (root;...;leaf), the input format of
+    flame graph tools
+    """
+    def __init__(self, thread_id, interval = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Tally()
+        self.running = True
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+def callback_name():
+    # Salida del callback (p.ej. "weather_plot.figure") a partir del cuerpo de la petición
+    body = request.get_json(silent = True) or {}
+    return str(body.get("output", "unknown"))
+
+def before_request():
+    g.metrics_start = time.perf_counter()
+    if PROFILE:
+        g.metrics_sampler = Sampler(threading.get_ident())
+
+def after_request(response):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return response
+    duration = time.perf_counter() - start
+    if request.path.endswith("_dash-update-component"):
+        name = callback_name()
+        CALLBACK_LATENCY.observe(duration, callback = name)
+        if not response.direct_passthrough:
+            CALLBACK_SIZE.observe(len(response.get_data()), callback = name)
+        if response.status_code >= 400:
+            CALLBACK_ERRORS.inc(callback = name)
+    else:
+        # Ruta (no la URL) para no crear una serie por cada versión de un mapa
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_LATENCY.observe(duration, route = route)
+    sampler = g.pop("metrics_sampler", None)
+    if sampler is not None:
+        sampler.stop()
+        if duration * 1000 >= PROFILE_SLOW_MS:
+            name = callback_name() if request.path.endswith("_dash-update-component") else request.path.strip("/")
+            safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)[:80]
+            sampler.dump(os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(duration * 1000)}ms-{safe}.folded"))
+            PROFILES.inc()
+    return response
+
+def init_app(server):
+    # Registra los hooks de Flask y la ruta /metrics
+    server.before_request(before_request)
+    server.after_request(after_request)
+    server.add_url_rule("/metrics", "metrics", lambda: Response(render(), mimetype = "text/plain; version=0.0.4"))
@@ -1,32 +1,58 @@
-from data import get_data
+from data import get_data, update_data, load_data, STATION_NAMES
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.neural_network import MLPRegressor
 from sklearn.linear_model import LinearRegression
+import os
+import json
+import time
 import pickle
+import sys
+import threading
+import subprocess
+import multiprocessing
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from utils import exists
+from concurrent.futures import ProcessPoolExecutor
+from utils import exists, acquire_lock, release_lock
+import metadata
+import metrics
+import storage
+from inference import export_models, load_fused, predict_all
+
+# Entrenamiento en segundo plano
+TRAINING_STATE_PATH = "data/training.json"
+TRAINING_LOCK_PATH = "data/model.lock"
+# Lectura y escritura del estado: el proceso que lanza el entrenamiento y el hijo lo actualizan a la vez
+TRAINING_STATE_LOCK_PATH = "data/training.lock"
+RETRAIN_BACKOFF = 600
+_loaded = {"key": None, "models": None}
+_loaded_lock = threading.Lock()
+_training = {"process": None}
+_grid = {"key": None, "grid": None}
+_climatology = {"key": None, "weather": None}
+_climatology_lock = threading.Lock()
+
+# Entrenamiento en paralelo: procesos (por defecto uno por núcleo) o un único modelo multi-salida
+TRAIN_N_JOBS = int(os.environ.get("TRAIN_N_JOBS", "0")) or None
+TRAIN_MULTI_OUTPUT = os.environ.get("TRAIN_MULTI_OUTPUT", "0") == "1"
+TARGETS = {"co": "co", "so2": "so2", "pm": "pm2_5"}
+
+# Malla de predicciones precalculada para la página Future
+PREDICTION_GRID = os.environ.get("PREDICTION_GRID", "1") == "1"
+GRID_PATH = "data/model-grid.npz"
+MONTHS = np.arange(1, 13)
+
+# Inferencia: "numpy" (pesos exportados a data/model.npz) o "sklearn" (modelo en pickle)
+MODEL_INFERENCE = os.environ.get("MODEL_INFERENCE", "numpy")
+MODEL_ARRAYS_PATH = "data/model.npz"
 
 def get_model_data():
     # Cargar y procesar datos
     stations = get_data("stations")[["name", "cars_per_day", "trees"]]
     weather_pollution = get_data("weather-pollution")
-    names = {
-        "Universidad Politécnica": "Politecnico",
-        "Boulevar Sur": "Bulevard Sud",
-        "Molí del Sol": "Moli del Sol",
-        "Viveros": "Viveros",
-        "Centro": "Valencia Centro",
-        "Olivereta": "Conselleria Meteo",
-        "Francia": "Avda. Francia",
-        "Pista de Silla": "Pista Silla",
-        "Dr. Lluch": "Puerto Valencia",
-        "Cabanyal": "Nazaret Meteo",
-        "Patraix": ""
-    }
-    stations["name"] = stations["name"].apply(lambda x: names[x])
-    weather_pollution = weather_pollution.groupby(["station", "date"]).mean().reset_index()
+    stations["name"] = stations["name"].apply(lambda x: STATION_NAMES[x])
+    weather_pollution = weather_pollution.groupby(["station", "date"], observed = True).mean().reset_index()
     weather_pollution = weather_pollution.merge(stations, left_on = "station", right_on = "name")
     weather_pollution = weather_pollution[["temperature", "wind_speed", "rainfall", "co", "so2", "pm2_5", "cars_per_day", "trees"]]
     model_data = weather_pollution.dropna()
@@ -34,50 +60,90 @@ def get_model_data():
 
 def update_models(info, models):
     path = info[3]
-    # Guardar modelo
-    with open(path, "wb") as file:
+    # Guardar modelo en un temporal y sustituirlo de forma atómica
+    tmp_path = storage.tmp_path(path)
+    with open(tmp_path, "wb") as file:
         pickle.dump(models, file)
+    os.replace(tmp_path, path)
+
+class TargetModel:
+    """
+    One output of a multi-output regressor, with the same predict
+    interface as the single-target models.
+    """
+    def __init__(self, model, index):
+        self.model = model
+        self.index = index
 
-def update_metadata(info):
-    date = datetime.strftime(datetime.today(), "%Y-%m-%d")
-    name = info[0]
-    # Actualizar Archimo metadatos
-    with open("data/metadata.txt", "r") as file:
-        upt_info = []
-        for line in file.read().splitlines():
-            line = line.split(",")
-            if line[0] == name:
-                line[1] = "1"
-                line[2] = date
-            upt_info.append(",".join(line)) 
-    with open("data/metadata.txt", "w") as file:
-        txt = "\n".join(upt_info)
-        file.write(txt)
-
-def train_models(info):
+    def predict(self, X):
+        return self.model.predict(X)[:, self.index]
+
+def new_model():
+    return MLPRegressor(hidden_layer_sizes = (10, 10),
+                        activation = "tanh")
+
+def fit_model(X, y):
+    # Entrena un modelo y devuelve también el tiempo que ha tardado
+    start = time.perf_counter()
+    model = new_model()
+    model.fit(X, y)
+    return model, time.perf_counter() - start
+
+def train_models(info, n_jobs = None, multi_output = None):
     # Cargar datos, entrenar modelo y guardarlo
+    n_jobs = n_jobs or TRAIN_N_JOBS or os.cpu_count() or 1
+    multi_output = TRAIN_MULTI_OUTPUT if multi_output is None else multi_output
     model_data = get_model_data()
     X = model_data[["temperature", "wind_speed", "rainfall", "cars_per_day", "trees"]]
-    y_co, y_so2, y_pm = model_data[["co"]], model_data[["so2"]], model_data[["pm2_5"]]
-    co_model = MLPRegressor(hidden_layer_sizes = (10, 10),
-                         activation = "tanh")
-    co_model.fit(X, y_co)
-    so2_model = MLPRegressor(hidden_layer_sizes = (10, 10),
-                         activation = "tanh")
-    so2_model.fit(X, y_so2)
-    pm_model = MLPRegressor(hidden_layer_sizes = (10, 10),
-                         activation = "tanh")
-    pm_model.fit(X, y_pm)
-    models = {"co": co_model, "so2": so2_model, "pm": pm_model}
+    start = time.perf_counter()
+    if multi_output:
+        # Un único modelo para los tres contaminantes
+        model, duration = fit_model(X, model_data[list(TARGETS.values())])
+        models = {name: TargetModel(model, i) for i, name in enumerate(TARGETS)}
+        durations = {"multi_output": round(duration, 2)}
+    elif n_jobs > 1:
+        # Un proceso por contaminante
+        with ProcessPoolExecutor(max_workers = min(n_jobs, len(TARGETS)), 
+                                 mp_context = multiprocessing.get_context("spawn")) as executor:
+            futures = {name: executor.submit(fit_model, X, model_data[[column]]) for name, column in TARGETS.items()}
+            results = {name: future.result() for name, future in futures.items()}
+        models = {name: result[0] for name, result in results.items()}
+        durations = {name: round(result[1], 2) for name, result in results.items()}
+    else:
+        results = {name: fit_model(X, model_data[[column]]) for name, column in TARGETS.items()}
+        models = {name: result[0] for name, result in results.items()}
+        durations = {name: round(result[1], 2) for name, result in results.items()}
+    wall = round(time.perf_counter() - start, 2)
+    print(f"Models trained in {wall} s: " + ", ".join(f"{name} {t} s" for name, t in durations.items()))
+    update_training_status(target_durations = durations, training_wall = wall)
     update_models(info, models)
-    update_metadata(info)
+    export_arrays(info, models)
+    metadata.record_update(info[0])
     return models
 
+def export_arrays(info, models):
+    # Exporta los pesos para la versión (mtime) del pickle, si no se puede se usará scikit-learn
+    try:
+        export_models(models, MODEL_ARRAYS_PATH, str(os.path.getmtime(info[3])))
+    except Exception as e:
+        print(f"Could not export the model arrays: {e}")
+
 def load_models(info):
     path = info[3]
+    version = str(os.path.getmtime(path))
+    # Pesos exportados y comprobados -> Sin deserializar scikit-learn
+    if MODEL_INFERENCE == "numpy":
+        fused = load_fused(MODEL_ARRAYS_PATH, version)
+        if fused is not None:
+            return fused
     # Carga modelo y lo devuelve
     with open(path, "rb") as file:
         models = pickle.load(file)
+    if MODEL_INFERENCE == "numpy":
+        export_arrays(info, models)
+        fused = load_fused(MODEL_ARRAYS_PATH, version)
+        if fused is not None:
+            return fused
     return models
 
 def update_weather():
@@ -85,47 +151,272 @@ def update_weather():
     weather = weather[["date", "temperature", "rainfall", "wind_speed", "co", "so2", "pm2_5"]]
     weather["month"] = weather["date"].apply(lambda x: x.month)
     data = weather.groupby("month").mean([""]).reset_index()
-    update_metadata(["month-weather"])
-    data.to_json("data/month-weather.json", indent = 4, orient = "records")
+    update_data(data, "data/month-weather.json")
+    metadata.record_update("month-weather", data = data)
 
-def get_weather(month):
-    status, info = exists("month-weather")
+def dataset_version(name):
+    # Fecha en metadata, mtime y tamaño del archivo local
+    status, info = exists(name)
     if not status:
-        raise Exception("The databese does not exist")
-    path = info[3]
-    data = pd.read_json(path)
-    month = data[data["month"] == month].to_numpy().tolist()[0][1:]
-    return month
+        raise Exception(f"The database {name} does not exist")
+    path = storage.backend_path(info[3], storage.get_backend())
+    path = path if os.path.exists(path) else info[3]
+    if not os.path.exists(path):
+        return f"{info[2]}@0"
+    stat = os.stat(path)
+    return f"{info[2]}@{stat.st_mtime_ns}:{stat.st_size}"
+
+def climatology():
+    # Clima mensual en un array de 12 filas (mes 1 -> fila 0) sin la columna month, se recarga si cambia la versión
+    version = dataset_version("month-weather")
+    with _climatology_lock:
+        metrics.cache("climatology", _climatology["key"] == version)
+        if _climatology["key"] != version:
+            status, info = exists("month-weather")
+            data = load_data(info).to_numpy(dtype = float)
+            weather = np.full((len(MONTHS), data.shape[1] - 1), np.nan)
+            weather[data[:, 0].astype(int) - 1] = data[:, 1:]
+            weather.flags.writeable = False
+            _climatology.update(key = version, weather = weather)
+        return _climatology["weather"]
+
+def get_weather(month):
+    return climatology()[month - 1].tolist()
+
+def model_inputs(month, trees, cars):
+    # Entradas del modelo a partir de la fila del mes (sin la columna month)
+    return month[1:4] + [trees, cars]
+
+def batch_inputs(weather, months, trees, cars):
+    # model_inputs para muchas filas a la vez
+    months = np.asarray(months, dtype = int)
+    return np.column_stack([weather[months - 1, 1:4], np.asarray(trees, dtype = float), np.asarray(cars, dtype = float)])
+
+def predict_batch(models, rows):
+    """
+    Predict every (month, trees, cars) row in one call, returns a
+    DataFrame with the inputs and one column per pollutant
+    """
+    rows = np.asarray(rows, dtype = float).reshape(-1, 3)
+    X = batch_inputs(climatology(), rows[:, 0], rows[:, 1], rows[:, 2])
+    predictions = predict_all(models, X)
+    data = pd.DataFrame({"month": rows[:, 0].astype(int), "trees": rows[:, 1], "cars": rows[:, 2]})
+    for label, values in zip(models.keys(), predictions):
+        data[label] = values
+    return data
 
 def predict(models, values):
     month = get_weather(values[0])
-    values = month[1:4] + values[1:]
-    predictions = {}
-    values = np.array([values])
-    for name, model in models.items():
-        print(name)
-        pred = model.predict(values)
-        predictions[name] = pred
+    predictions = predict_batch(models, [values])
     predictions_df = pd.DataFrame({
-        "label": predictions.keys(),
+        "label": list(models.keys()),
         "actual": month[3:],
-        "model": list(float(v[0]) for v in predictions.values())
+        "model": predictions[list(models.keys())].iloc[0].to_numpy(dtype = float)
+        }
+    )
+    return predictions_df
+
+def grid_version():
+    # La malla depende del modelo entrenado y del clima mensual
+    return "|".join(dataset_version(name) for name in ["model", "month-weather"])
+
+def compute_grid_rows(models, weather, months, trees_values, cars_values):
+    # Una sola llamada a predict por modelo para todas las combinaciones
+    m, t, c = np.meshgrid(months, trees_values, cars_values, indexing = "ij")
+    if m.size == 0:
+        return np.empty((len(models), 0), dtype = np.float32)
+    X = batch_inputs(weather, m.ravel(), t.ravel(), c.ravel())
+    return predict_all(models, X).astype(np.float32)
+
+def compute_grid(models, trees_values, cars_values, previous = None):
+    weather = climatology()
+    trees_values = np.asarray(trees_values, dtype = float)
+    cars_values = np.asarray(cars_values, dtype = float)
+    shape = (len(models), len(MONTHS), len(trees_values), len(cars_values))
+    predictions = np.empty(shape, dtype = np.float32)
+    new_trees = np.ones(len(trees_values), dtype = bool)
+    new_cars = np.ones(len(cars_values), dtype = bool)
+    # Reutiliza las celdas de la malla anterior si los ejes coinciden en parte
+    if previous is not None:
+        old_trees = {v: i for i, v in enumerate(previous["trees"])}
+        old_cars = {v: i for i, v in enumerate(previous["cars"])}
+        new_trees = np.array([v not in old_trees for v in trees_values], dtype = bool)
+        new_cars = np.array([v not in old_cars for v in cars_values], dtype = bool)
+        keep_t = np.flatnonzero(~new_trees)
+        keep_c = np.flatnonzero(~new_cars)
+        src_t = [old_trees[v] for v in trees_values[keep_t]]
+        src_c = [old_cars[v] for v in cars_values[keep_c]]
+        predictions[:, :, keep_t[:, None], keep_c[None, :]] = previous["predictions"][:, :, np.array(src_t, dtype = int)[:, None], np.array(src_c, dtype = int)[None, :]]
+    # Filas nuevas: árboles nuevos con todos los coches y coches nuevos con los árboles conservados
+    t_new = np.flatnonzero(new_trees)
+    t_old = np.flatnonzero(~new_trees)
+    c_new = np.flatnonzero(new_cars)
+    rows_a = compute_grid_rows(models, weather, MONTHS, trees_values[t_new], cars_values)
+    rows_b = compute_grid_rows(models, weather, MONTHS, trees_values[t_old], cars_values[c_new])
+    predictions[:, :, t_new, :] = rows_a.reshape(len(models), len(MONTHS), len(t_new), len(cars_values))
+    predictions[:, :, t_old[:, None], c_new[None, :]] = rows_b.reshape(len(models), len(MONTHS), len(t_old), len(c_new))
+    actual = weather[MONTHS - 1, 3:].astype(np.float32)
+    return {
+        "labels": np.array(list(models.keys())),
+        "trees": trees_values,
+        "cars": cars_values,
+        "predictions": predictions,
+        "actual": actual
+    }
+
+def load_grid(version):
+    if not os.path.exists(GRID_PATH):
+        return None
+    with np.load(GRID_PATH) as file:
+        grid = {key: file[key] for key in file.files}
+    grid["valid"] = str(grid.pop("version")) == version
+    return grid
+
+def get_prediction_grid(models, trees_values, cars_values):
+    version = grid_version()
+    # Caché en memoria -> Solo se lee del disco si cambia la versión
+    cached = _grid["grid"]
+    if cached is not None and _grid["key"] == version:
+        if np.array_equal(cached["trees"], trees_values) and np.array_equal(cached["cars"], cars_values):
+            metrics.cache("prediction_grid", True)
+            return cached
+    grid = load_grid(version)
+    labels = np.array(list(models.keys()))
+    # Misma versión y mismos ejes -> Reutilizar sin recalcular
+    if grid is not None and grid["valid"] and np.array_equal(grid["labels"], labels):
+        if np.array_equal(grid["trees"], trees_values) and np.array_equal(grid["cars"], cars_values):
+            _grid.update(key = version, grid = grid)
+            metrics.cache("prediction_grid", True)
+            return grid
+        grid = compute_grid(models, trees_values, cars_values, grid)
+    else:
+        grid = compute_grid(models, trees_values, cars_values)
+    metrics.cache("prediction_grid", False)
+    tmp_path = storage.tmp_path(GRID_PATH, ".tmp.npz")
+    np.savez(tmp_path, version = version, **grid)
+    os.replace(tmp_path, GRID_PATH)
+    grid["valid"] = True
+    _grid.update(key = version, grid = grid)
+    return grid
+
+def grid_predict(grid, values):
+    # Busca la predicción en la malla, devuelve None si el valor no está en ella
+    month, trees, cars = values
+    t = np.searchsorted(grid["trees"], trees)
+    c = np.searchsorted(grid["cars"], cars)
+    if t >= len(grid["trees"]) or grid["trees"][t] != trees or c >= len(grid["cars"]) or grid["cars"][c] != cars:
+        return None
+    predictions_df = pd.DataFrame({
+        "label": grid["labels"],
+        "actual": grid["actual"][month - 1].astype(float),
+        "model": grid["predictions"][:, month - 1, t, c].astype(float)
         }
     )
     return predictions_df
 
+def training_status():
+    # Estado del entrenamiento: status, started, last_success, duration, error
+    if not os.path.exists(TRAINING_STATE_PATH):
+        return {"status": "idle"}
+    with open(TRAINING_STATE_PATH) as file:
+        return json.load(file)
+
+def update_training_status(**values):
+    lock = acquire_lock(TRAINING_STATE_LOCK_PATH, blocking = True)
+    try:
+        status = training_status()
+        status.update(values)
+        tmp_path = storage.tmp_path(TRAINING_STATE_PATH)
+        with open(tmp_path, "w") as file:
+            json.dump(status, file)
+        os.replace(tmp_path, TRAINING_STATE_PATH)
+    finally:
+        release_lock(lock)
+
+@metrics.collector
+def training_metrics():
+    # El entrenamiento se hace en otro proceso -> Se lee su estado al pedir /metrics
+    status = training_status()
+    metrics.TRAINING_RUNNING.set(int(status["status"] == "running"))
+    for target, seconds in (status.get("target_durations") or {}).items():
+        metrics.TRAINING_SECONDS.set(seconds, target = target)
+    if "training_wall" in status:
+        metrics.TRAINING_SECONDS.set(status["training_wall"], target = "all")
+
+def now():
+    return datetime.strftime(datetime.now(), "%Y-%m-%dT%H:%M:%S")
+
+def train_job():
+    # Se ejecuta en un proceso aparte que hereda el bloqueo del proceso que lo lanza (se libera al terminar)
+    start = time.time()
+    try:
+        update_training_status(status = "running", started = now(), pid = os.getpid())
+        status, info = exists("model")
+        update_weather()
+        train_models(info)
+        update_training_status(status = "success", last_success = now(), 
+                               duration = round(time.time() - start, 1), error = None)
+    except Exception as e:
+        update_training_status(status = "failed", finished = now(), 
+                               duration = round(time.time() - start, 1), error = str(e))
+        print(f"Model training failed: {e}")
+
+def wait_training(process):
+    # Recoge el proceso hijo; si termina sin dejar su estado (p.ej. falla al arrancar o lo matan) se marca como fallido
+    returncode = process.wait()
+    status = training_status()
+    if status["status"] == "running" and status.get("pid") == process.pid:
+        update_training_status(status = "failed", finished = now(),
+                               error = f"Training process exited with code {returncode}")
+
+def start_training():
+    # Lanza el entrenamiento si ningún otro proceso lo está haciendo
+    status = training_status()
+    if status["status"] == "failed" and "finished" in status:
+        finished = datetime.strptime(status["finished"], "%Y-%m-%dT%H:%M:%S")
+        if (datetime.now() - finished).total_seconds() < RETRAIN_BACKOFF:
+            return False
+    lock = acquire_lock(TRAINING_LOCK_PATH)
+    if lock is None:
+        return False
+    try:
+        update_training_status(status = "running", started = now())
+        # Proceso nuevo que solo importa model (no las páginas de la aplicación) y hereda el bloqueo
+        process = subprocess.Popen([sys.executable, "-c", "import model; model.train_job()"], pass_fds = [lock.fileno()])
+        update_training_status(pid = process.pid)
+    finally:
+        release_lock(lock)
+    _training["process"] = process
+    threading.Thread(target = wait_training, args = (process,), daemon = True).start()
+    return True
+
 def get_models():
     status, info = exists("model")
     if not status:
         raise Exception("The model does not exist")
     updated = bool(int(info[1]))
+    path = info[3]
     # Comprueba si el modelo está acutalizado 
-    if updated:
-        # Entonces -> carga y lo devuelve
-        models = load_models(info)
-    else:
-        print("There was an update, training the model...")
-        # Sino -> Carga datos, entrena, guarda y devuelve
-        update_weather()
-        models = train_models(info)
-    return models
\ No newline at end of file
+    if not updated:
+        if os.path.exists(path):
+            # Sino -> Entrena en segundo plano mientras sirve el modelo anterior
+            if start_training():
+                print("There was an update, training the model in background...")
+        else:
+            # Sin modelo previo -> Entrena y espera
+            print("There was an update, training the model...")
+            lock = acquire_lock(TRAINING_LOCK_PATH, blocking = True)
+            try:
+                if not os.path.exists(path):
+                    update_weather()
+                    train_models(info)
+            finally:
+                release_lock(lock)
+    # Carga el modelo solo si ha cambiado el archivo desde la última vez
+    key = os.path.getmtime(path)
+    with _loaded_lock:
+        metrics.cache("models", _loaded["key"] == key)
+        if _loaded["key"] != key:
+            _loaded["models"] = load_models(info)
+            _loaded["key"] = key
+        return _loaded["models"]
@@ -1,25 +1,64 @@
 from dash import html, dcc
 from .navbar import create_navbar
 import plotly.express as px
-from model import get_models, predict
+from model import get_models, predict, get_prediction_grid, grid_predict, training_status, PREDICTION_GRID
 from dash.dependencies import Input, Output
 import plotly.graph_objects as go
-from data import get_data
+from shared import attach
 from app import app
+from caching import memoize, data_version
+import numpy as np
+import threading
 
 nav = create_navbar()
-models = get_models()
-weather = get_data("month-weather")[["month", "temperature", "rainfall", "wind_speed"]]
+# Rangos de los selectores (mínimo, máximo, paso)
+trees_range = (500, 3000, 50)
+cars_range = (50000, 500000, 12500)
+trees_values = np.arange(trees_range[0], trees_range[1] + trees_range[2], trees_range[2])
+cars_values = np.arange(cars_range[0], cars_range[1] + cars_range[2], cars_range[2])
 months = [
     "January", "February", "March", "April", "May", "June",
     "July", "August", "September", "October", "November", "December"
 ]
 
+# Clima mensual, se carga en la primera visita o en la precarga de index.py y cuando cambia su versión
+_weather = {"version": None, "weather": None}
+_weather_lock = threading.Lock()
+
+def get_month_weather():
+    version = data_version(["month-weather"])
+    with _weather_lock:
+        if _weather["version"] != version:
+            _weather["weather"] = attach("month-weather")[["month", "temperature", "rainfall", "wind_speed"]]
+            _weather["version"] = version
+        return _weather["weather"]
+
+def warm_up():
+    # Carga (o entrena) el modelo y calcula la rejilla de predicciones
+    models = get_models()
+    if PREDICTION_GRID:
+        get_prediction_grid(models, trees_values, cars_values)
+    get_month_weather()
+
 @app.callback(
     Output("actual_model_plot", "figure"),
     [Input("month_selector", "value"), Input("trees_selector", "value"), Input("cars_selector", "value")])
 def get_barplot(month, trees, cars):
-    predictions = predict(models, [months.index(month)+1, trees[0], cars[0]])
+    # Fuera de la caché: comprueba si hay que reentrenar en segundo plano
+    get_models()
+    return barplot_figure(month, trees[0], cars[0])
+
+@memoize(datasets = ["model", "month-weather"])
+def barplot_figure(month, trees, cars):
+    # Si se ha reentrenado en segundo plano get_models devuelve el modelo nuevo
+    models = get_models()
+    values = [months.index(month)+1, trees, cars]
+    predictions = None
+    if PREDICTION_GRID:
+        grid = get_prediction_grid(models, trees_values, cars_values)
+        predictions = grid_predict(grid, values)
+    if predictions is None:
+        predictions = predict(models, values)
     fig = px.bar(predictions, x = "label", y = ["actual", "model"], 
              barmode = "group", hover_data = {"label":False, "variable": False, "value": ":.4f"},
              labels = {"value": "Value"})
@@ -37,10 +76,25 @@ def get_barplot(month, trees, cars):
     fig.for_each_trace(lambda t: t.update(name={'actual': 'Actual', 'model': 'Model'}.get(t.name, t.name)))
     return fig
 
+@app.callback(
+    Output("training_status", "children"),
+    [Input("training_interval", "n_intervals")])
+def get_training_status(n):
+    status = training_status()
+    if status["status"] == "running":
+        return f"Model training in progress (started {status['started']})."
+    if status["status"] == "failed":
+        return f"Last model training failed: {status['error']}"
+    if "last_success" in status:
+        return f"Model last trained {status['last_success']} in {status['duration']} s."
+    return ""
+
 @app.callback(
     Output("weather_month_plot", "figure"),
     [Input("month_selector", "value")])
+@memoize(datasets = ["month-weather"])
 def get_weather(month):
+    weather = get_month_weather()
     month_data = weather[weather["month"] == months.index(month)+1]
     fig = go.Figure()
     fig.add_trace(go.Indicator(
@@ -67,10 +121,10 @@ def get_weather(month):
 
 n_trees = dcc.RangeSlider(
     id = "trees_selector",
-    min = 500,
-    max = 3000,
+    min = trees_range[0],
+    max = trees_range[1],
     value = [1200],
-    step = 50,
+    step = trees_range[2],
     tooltip={"placement": "bottom", "always_visible": False},
     marks={
         500: {'label': '500', 'style': {'color': '#ff051a'}},
@@ -83,9 +137,9 @@ n_trees = dcc.RangeSlider(
 )
 n_cars = dcc.RangeSlider(
     id = "cars_selector",
-    min = 50000,
-    max = 500000,
-    step = 12500,
+    min = cars_range[0],
+    max = cars_range[1],
+    step = cars_range[2],
     value = [150000],
     tooltip={"placement": "bottom", "always_visible": False},
     marks={
@@ -138,6 +192,8 @@ def create_page_future():
         html.Div([
             dcc.Graph(id = "actual_model_plot",
                       style = {'height': 'auto'}),
+            html.Small(id = "training_status", className = "text-muted"),
+            dcc.Interval(id = "training_interval", interval = 30000)
         ], style={'width': '67%', 'display': 'inline-block', 'verticalAlign': 'top'})
     ])
     return layout
\ No newline at end of file
@@ -1,33 +1,71 @@
 from dash import html, dcc
 from .navbar import create_navbar
 from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
 import plotly.express as px
-from app import app
-from data import get_data
+import dash
+import threading
+from timeseries import load_stores, query, visible_range, store_version
+from caching import memoize
+from background import heavy_callback, progress_bar, report
 
 nav = create_navbar()
 title = html.H3("Environmental measurement Stations in Valencia")
 text = html.P("Pollution measurement stations in Valencia are essential for monitoring air quality and its components, such as particulate matter (PM10, PM2.5), nitrogen oxides (NOx), sulfur dioxide (SO2), ozone (O3) and carbon monoxide (CO). This information is crucial for understanding air pollution levels and their effects on public health and the environment.")
 text2 = html.P("The importance of these stations lies in several key aspects: First, they help control the adverse effects of pollution on local ecosystems, including parks and urban green areas, as well as nearby water resources. They also provide the data needed to develop effective environmental management policies and sustainable urban planning. This includes the creation of green zones, restrictions on vehicular traffic in sensitive areas, and the promotion of cleaner forms of transportation.")
 
-weather_pollution = get_data("weather-pollution")
-grouped = weather_pollution.groupby(["station", "date"]).mean().reset_index()
-stations = list(weather_pollution["station"].unique())
+level_names = {"raw": "", "daily": " (daily means)", "weekly": " (weekly means)", "monthly": " (monthly means)"}
 weather_opts = ["Temperature", "Humidity", "Rainfall", "Wind Speed"]
 weather_mag = ["ºC", "%", "mm", "km/h"]
 pollution_opts = ["NO", "NO2", "O3", "CO", "SO2", "PM 2.5", "PM 10"]
 
-@app.callback(
+# Series por estación (y sus medias diarias, semanales y mensuales), compartidas por ambos gráficos
+# Se cargan en la primera visita o en la precarga de index.py
+# Se vuelven a cargar si cambia la versión de weather-pollution
+_stores = {"version": None, "stores": None}
+_stores_lock = threading.Lock()
+
+def get_stores():
+    version = store_version()
+    with _stores_lock:
+        if _stores["version"] != version:
+            _stores["stores"] = load_stores()
+            _stores["version"] = version
+        return _stores["stores"]
+
+def warm_up():
+    get_stores()
+
+def zoom_range(relayout, graph):
+    # El rango solo se aplica si lo ha disparado el zoom del propio gráfico:
+    # al cambiar de estación o de medida se consulta la serie completa
+    if dash.callback_context.triggered_id != graph:
+        return None
+    # Solo se vuelve a consultar si el relayout cambia el rango del eje x
+    x_range = visible_range(relayout)
+    if x_range is None and not (relayout or {}).get("xaxis.autorange"):
+        raise PreventUpdate
+    return x_range
+
+@heavy_callback(
     Output("weather_plot", "figure"),
-    [Input("stations_selector", "value"), Input("measure_weather_selector", "value")])
-def get_weather_plot(stations, measure):
+    [Input("stations_selector", "value"), Input("measure_weather_selector", "value"),
+     Input("weather_plot", "relayoutData")],
+    "weather_progress", cancel = [Input("url", "pathname")])
+def get_weather_plot(stations, measure, relayout = None):
     if isinstance(stations, str):
         stations = [stations]
-    filtered = grouped[grouped["station"].isin(stations)]
+    return weather_figure(stations, measure, zoom_range(relayout, "weather_plot"))
+
+@memoize(version = store_version)
+def weather_figure(stations, measure, x_range):
     measure_ = measure.replace(" ", "_").lower()
+    filtered, level = query(get_stores(), stations or [], measure_, x_range)
+    report(1, 2)
     fig = px.line(filtered, x = "date", y = measure_, color = "station")
     fig.update_layout(
-        title = "Climate measures",
+        title = "Climate measures" + level_names[level],
+        uirevision = f"{stations}{measure}",
         xaxis_title = "Date",
         yaxis_title = f"{measure} ({weather_mag[weather_opts.index(measure)]})",
         showlegend = False,
@@ -37,17 +75,25 @@ def get_weather_plot(stations, measure):
     fig.update_layout(hovermode="x unified")
     return fig
 
-@app.callback(
+@heavy_callback(
     Output("pollution_plot", "figure"),
-    [Input("stations_selector", "value"), Input("measure_pollution_selector", "value")])
-def get_pollution_plot(stations, measure):
+    [Input("stations_selector", "value"), Input("measure_pollution_selector", "value"),
+     Input("pollution_plot", "relayoutData")],
+    "pollution_progress", cancel = [Input("url", "pathname")])
+def get_pollution_plot(stations, measure, relayout = None):
     if isinstance(stations, str):
         stations = [stations]
-    filtered = grouped[grouped["station"].isin(stations)]
+    return pollution_figure(stations, measure, zoom_range(relayout, "pollution_plot"))
+
+@memoize(version = store_version)
+def pollution_figure(stations, measure, x_range):
     measure_ = measure.replace(" ", "").replace(".", "_").lower()
+    filtered, level = query(get_stores(), stations or [], measure_, x_range)
+    report(1, 2)
     fig = px.line(filtered, x = "date", y = measure_, color = "station")
     fig.update_layout(
-        title = "Contaminant measures",
+        title = "Contaminant measures" + level_names[level],
+        uirevision = f"{stations}{measure}",
         xaxis_title = "Date",
         yaxis_title = f"{measure} (PPM)",
         showlegend = False,
@@ -57,13 +103,16 @@ def get_pollution_plot(stations, measure):
     fig.update_layout(hovermode="x unified")
     return fig
 
-stations_selc = dcc.Dropdown(
-    id = "stations_selector",
-    options = stations,
-    value = stations[6],
-    clearable = True,
-    multi = True,
-    )
+def create_stations_selector():
+    stations = get_stores()["raw"].stations
+    return dcc.Dropdown(
+        id = "stations_selector",
+        options = stations,
+        value = stations[6],
+        clearable = True,
+        multi = True,
+        )
+
 weather = dcc.Dropdown(
     id = "measure_weather_selector",
     options = weather_opts,
@@ -88,13 +137,14 @@ def create_page_home():
             text, text2
         ], style = {"margin": "1em"}),
         html.Div([
+            progress_bar("weather_progress"),
             dcc.Graph(id = "weather_plot",
                       style = {'height': 'auto'}),
         ], style={'width': '40%', 'display': 'inline-block', 'verticalAlign': 'top'}),
         html.Div([
             html.Br(),
             html.P("Select station:"),
-            stations_selc,
+            create_stations_selector(),
             html.Br(),
             html.Br(),
             html.P("Select climate measure:"),
@@ -105,6 +155,7 @@ def create_page_home():
             pollution
         ], style={'width': '20%', 'display': 'inline-block', 'verticalAlign': 'top'}),
         html.Div([
+            progress_bar("pollution_progress"),
             dcc.Graph(id = "pollution_plot",
                       style = {'height': 'auto'}),
         ], style={'width': '40%', 'display': 'inline-block', 'verticalAlign': 'top'}),
@@ -1,6 +1,6 @@
 from dash import html, dcc
 from .navbar import create_navbar
-from data import get_data
+from shared import attach
 from app import app
 from dash.dependencies import Input, Output
 import plotly.graph_objects as go
@@ -8,6 +8,16 @@ import folium
 from folium.plugins import HeatMap
 import branca.colormap as cm
 import numpy as np
+import os
+import hashlib
+import threading
+from flask import send_file, abort
+from model import get_models
+from raster import get_raster, get_features, raster_version, colorize
+import storage
+import metrics
+from caching import memoize, data_version
+from background import heavy_callback, progress_bar, report
 
 nav = create_navbar()
 title = html.H3("Urban Microclimates")
@@ -15,17 +25,42 @@ text = html.P("Urban microclimates refer to local climatic variations within a c
 text2 = html.P("In relation to pollution, urban microclimates can intensify its effects. For example, areas with high traffic density tend to have higher concentrations of pollutants such as nitrogen oxides and particulate matter due to vehicle emissions.")
 text3 = html.P("Trees and other forms of vegetation can mitigate these effects in several ways. For one, they absorb carbon dioxide and other harmful gases, helping to clean the air and reduce air pollution levels. In addition, they provide shade and cool the environment through transpiration, which can partially counteract the effect of urban heat islands by reducing ambient temperatures.")
 
-stations = get_data("stations")
-trees = get_data("trees")
-stations_opts = stations["name"].unique().tolist()
-polls_avg = [stations["co"].mean().tolist(), stations["so2"].mean().tolist(), stations["pm"].mean().tolist()]
+MAP_CACHE_DIR = "data/cache"
+map_cache = {}
+# Datos de la página, se cargan en la primera visita o en la precarga de index.py
+# Se vuelven a cargar si cambia la versión de stations o trees
+_data = {"version": None, "data": None}
+_data_lock = threading.Lock()
 
-@app.callback(
-    Output("pollution_station_map", "srcDoc"),
-    [Input("station_selector", "value")])
-def get_map(station):
+def page_data():
+    version = data_version(["stations", "trees"])
+    with _data_lock:
+        if _data["version"] != version:
+            stations = attach("stations")
+            _data["data"] = {
+                "stations": stations,
+                "trees": attach("trees"),
+                "stations_opts": stations["name"].unique().tolist(),
+                "polls_avg": [stations["co"].mean().tolist(), stations["so2"].mean().tolist(), stations["pm"].mean().tolist()]
+            }
+            _data["version"] = version
+        return _data["data"]
+
+def warm_up():
+    page_data()
+    get_map()
+    # Variables de la malla de predicción (la parte más lenta)
+    get_features()
+
+def map_version():
+    # Versión del mapa a partir de la fecha y del archivo local de los datasets
+    # (update_stations reescribe las estaciones sin cambiar la fecha)
+    return hashlib.md5(data_version(["stations", "trees"]).encode()).hexdigest()[:12]
+
+def render_map():
+    stations, trees = page_data()["stations"], page_data()["trees"]
     map_ = folium.Map(location=[39.472792543187936, -0.37898723979425947], zoom_start=12.5, tiles='CartoDB positron')
-    heat_data = [[row['lat'], row['lon'], row['n']] for index, row in trees.iterrows()]
+    heat_data = trees[["lat", "lon", "n"]].to_numpy().tolist()
     colormap = cm.LinearColormap(['blue', 'lime', 'green'], vmin=min(trees['n']), vmax=max(trees['n']), caption='Trees')
     heat_layer = HeatMap(heat_data, radius=15, gradient={0: 'blue', 0.5: 'lime', 1: 'green'}, name="Trees")
     heat_layer.add_to(map_)
@@ -40,10 +75,98 @@ def get_map(station):
     folium.LayerControl().add_to(map_)
     return map_._repr_html_()
 
+def get_map():
+    # Renderiza el mapa una vez por versión de los datos y devuelve su URL
+    version = map_version()
+    metrics.cache("map", version in map_cache)
+    if version not in map_cache:
+        path = os.path.join(MAP_CACHE_DIR, f"map-{version}.html")
+        if not os.path.exists(path):
+            os.makedirs(MAP_CACHE_DIR, exist_ok = True)
+            tmp_path = storage.tmp_path(path)
+            with open(tmp_path, "w", encoding = "utf-8") as file:
+                file.write(render_map())
+            os.replace(tmp_path, path)
+        map_cache[version] = path
+    return f"/maps/microclimates-{version}.html"
+
+@heavy_callback(
+    Output("pollution_station_map", "src"),
+    [Input("url", "pathname")],
+    "map_progress")
+def update_map(pathname):
+    # Se renderiza fuera de la construcción de la página
+    return get_map()
+
+@app.server.route("/maps/microclimates-<version>.html")
+def serve_map(version):
+    # El HTML no cambia para una versión -> cacheable con ETag
+    path = map_cache.get(version) or os.path.join(MAP_CACHE_DIR, f"map-{version}.html")
+    if version != map_version() or not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype = "text/html", etag = True, conditional = True, max_age = 86400)
+
+# Mapa de predicción: malla sobre la ciudad por mes y contaminante
+raster_months = ["January", "February", "March", "April", "May", "June",
+                 "July", "August", "September", "October", "November", "December"]
+raster_labels = {"co": "CO", "so2": "SO2", "pm": "PM 2.5"}
+raster_colors = ["#1a9850", "#fee08b", "#d73027"]
+
+def prediction_version():
+    return hashlib.md5(raster_version().encode()).hexdigest()[:12]
+
+def render_prediction_map(month, label):
+    raster = get_raster(get_models(), month)
+    report(1, 2)
+    values = raster[label]
+    lon, lat = raster["lon"], raster["lat"]
+    # Bordes de la malla a partir de los centros de las celdas
+    dlon = (lon[-1] - lon[0]) / max(1, len(lon) - 1) / 2
+    dlat = (lat[-1] - lat[0]) / max(1, len(lat) - 1) / 2
+    bounds = [[float(lat[0] - dlat), float(lon[0] - dlon)], [float(lat[-1] + dlat), float(lon[-1] + dlon)]]
+    vmin, vmax = float(np.nanmin(values)), float(np.nanmax(values))
+    map_ = folium.Map(location=[39.472792543187936, -0.37898723979425947], zoom_start=12.5, tiles='CartoDB positron')
+    # La fila 0 de la malla es la latitud mínima -> Se invierte para la imagen
+    folium.raster_layers.ImageOverlay(colorize(values[::-1], raster_colors, vmin, vmax), bounds = bounds,
+                                      name = f"Predicted {raster_labels[label]}").add_to(map_)
+    cm.LinearColormap(raster_colors, vmin = vmin, vmax = vmax,
+                      caption = f"Predicted {raster_labels[label]} (PPM), {raster_months[month - 1]}").add_to(map_)
+    folium.LayerControl().add_to(map_)
+    return map_._repr_html_()
+
+def get_prediction_map(month, label):
+    # Renderiza el mapa una vez por versión, mes y contaminante y devuelve su URL
+    version = prediction_version()
+    path = os.path.join(MAP_CACHE_DIR, f"prediction-{version}-{month}-{label}.html")
+    metrics.cache("prediction_map", os.path.exists(path))
+    if not os.path.exists(path):
+        os.makedirs(MAP_CACHE_DIR, exist_ok = True)
+        tmp_path = storage.tmp_path(path)
+        with open(tmp_path, "w", encoding = "utf-8") as file:
+            file.write(render_prediction_map(month, label))
+        os.replace(tmp_path, path)
+    return f"/maps/prediction-{version}-{month}-{label}.html"
+
+@app.server.route("/maps/prediction-<version>-<int:month>-<label>.html")
+def serve_prediction_map(version, month, label):
+    path = os.path.join(MAP_CACHE_DIR, f"prediction-{version}-{month}-{label}.html")
+    if version != prediction_version() or not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype = "text/html", etag = True, conditional = True, max_age = 86400)
+
+@heavy_callback(
+    Output("prediction_map", "src"),
+    [Input("raster_month_selector", "value"), Input("raster_pollutant_selector", "value")],
+    "prediction_progress", cancel = [Input("url", "pathname")])
+def get_prediction(month, label):
+    return get_prediction_map(raster_months.index(month) + 1, label)
+
 @app.callback(
     Output("pollution_station_plot", "figure"),
     [Input("station_selector", "value")])
+@memoize(datasets = ["stations"])
 def get_pollution(station):
+    stations, polls_avg = page_data()["stations"], page_data()["polls_avg"]
     station_data = stations[stations["name"] == station]
     fig = go.Figure()
     fig.add_trace(go.Indicator(
@@ -77,13 +200,15 @@ def get_pollution(station):
     )
     return fig
 
-station = dcc.Dropdown(
-    id = "station_selector",
-    options = stations_opts,
-    value = stations_opts[0],
-    clearable = False,
-    multi = False,
-    )
+def create_station_selector():
+    stations_opts = page_data()["stations_opts"]
+    return dcc.Dropdown(
+        id = "station_selector",
+        options = stations_opts,
+        value = stations_opts[0],
+        clearable = False,
+        multi = False,
+        )
 
 def create_page_microclimates():
     layout = html.Div([
@@ -99,12 +224,23 @@ def create_page_microclimates():
             html.Div([
                 html.Br(),
                 html.Br(),
-                station
+                create_station_selector()
             ], style={'width': '40%', 'display': 'inline-block', 'verticalAlign': 'top'}),
             html.Div([
                 dcc.Graph(id = "pollution_station_plot")
             ], style={'width': '60%', 'display': 'inline-block', 'verticalAlign': 'top'}),
-            html.Iframe(id = "pollution_station_map", width='100%', height='600')
+            progress_bar("map_progress"),
+            html.Iframe(id = "pollution_station_map", width='100%', height='600'),
+            html.H5("Predicted pollution across the city"),
+            html.Div([
+                dcc.Dropdown(id = "raster_month_selector", options = raster_months, value = raster_months[0], clearable = False)
+            ], style={'width': '40%', 'display': 'inline-block', 'verticalAlign': 'top'}),
+            html.Div([
+                dcc.RadioItems(id = "raster_pollutant_selector", value = "co", inline = True,
+                               options = [{"label": f" {name} ", "value": label} for label, name in raster_labels.items()])
+            ], style={'width': '60%', 'display': 'inline-block', 'verticalAlign': 'top', "paddingLeft": "1em"}),
+            progress_bar("prediction_progress"),
+            html.Iframe(id = "prediction_map", width='100%', height='600')
         ], style={'width': '70%', 'display': 'inline-block', 'verticalAlign': 'top'})
     ])
     return layout
\ No newline at end of file
@@ -0,0 +1,123 @@
+# Predicción de contaminación en una malla regular sobre Valencia (página Microclimates).
+# Variables de cada celda con los índices espaciales (por bloques), predicción vectorizada por mes y caché.
+import os
+import hashlib
+import threading
+import numpy as np
+from utils import exists
+from data import get_data
+from spatial import build_trees_index, build_traffic_index, tree_density_grid, traffic_per_day_grid, EARTH_RADIUS
+from model import climatology, batch_inputs, dataset_version
+from inference import predict_all
+import storage
+import metrics
+
+# Número aproximado de celdas y celdas por bloque de la predicción (la memoria depende del bloque, no de la malla)
+RASTER_CELLS = int(os.environ.get("RASTER_CELLS", 100000))
+RASTER_CHUNK = int(os.environ.get("RASTER_CHUNK", 100000))
+RASTER_DIR = "data/cache"
+_features = {"key": None, "features": None}
+_predictions = {}
+_lock = threading.Lock()
+
+def raster_grid(bounds, cells = RASTER_CELLS):
+    # Malla de celdas aproximadamente cuadradas (en km) que cubre bounds = (lon_min, lat_min, lon_max, lat_max)
+    lon_min, lat_min, lon_max, lat_max = bounds
+    k = np.pi / 180 * EARTH_RADIUS
+    width = (lon_max - lon_min) * k * np.cos(np.radians((lat_min + lat_max) / 2))
+    height = (lat_max - lat_min) * k
+    nx = max(1, int(round(np.sqrt(cells * width / height))))
+    ny = max(1, int(round(cells / nx)))
+    # Centros de las celdas
+    lon = lon_min + (np.arange(nx) + 0.5) * (lon_max - lon_min) / nx
+    lat = lat_min + (np.arange(ny) + 0.5) * (lat_max - lat_min) / ny
+    return lon, lat
+
+def raster_bounds(trees):
+    # Extensión del inventario de árboles (cubre el término municipal)
+    return (float(trees["lon"].min()), float(trees["lat"].min()), float(trees["lon"].max()), float(trees["lat"].max()))
+
+def compute_features(lon, lat, trees_index, traffic_index):
+    # Densidad de árboles y coches por día de cada celda de la malla lon x lat (una fila por latitud)
+    # Cada árbol y cada tramo se rasteriza una vez sobre la malla, no se mide contra cada celda
+    trees = tree_density_grid(lon, lat, trees_index).astype(np.float32).ravel()
+    cars = traffic_per_day_grid(lon, lat, traffic_index).astype(np.float32).ravel()
+    return trees, cars
+
+def features_version():
+    versions = [",".join(exists(name)[1][:3]) for name in ["trees", "traffic"]]
+    return hashlib.md5(f"{'|'.join(versions)}|{RASTER_CELLS}".encode()).hexdigest()[:12]
+
+def get_features():
+    """
+    Grid and per-cell features, cached in memory and in data/cache for
+    each version of trees and traffic
+    """
+    version = features_version()
+    with _lock:
+        if _features["key"] == version:
+            metrics.cache("raster_features", True)
+            return _features["features"]
+        path = os.path.join(RASTER_DIR, f"raster-features-{version}.npz")
+        metrics.cache("raster_features", os.path.exists(path))
+        if os.path.exists(path):
+            with np.load(path) as file:
+                features = {key: file[key] for key in file.files}
+        else:
+            trees = get_data("trees")
+            traffic = get_data("traffic")
+            lon, lat = raster_grid(raster_bounds(trees))
+            density, cars = compute_features(lon, lat, build_trees_index(trees), build_traffic_index(traffic))
+            features = {"lon": lon, "lat": lat, "trees": density, "cars": cars}
+            os.makedirs(RASTER_DIR, exist_ok = True)
+            tmp_path = storage.tmp_path(path, ".tmp.npz")
+            np.savez(tmp_path, **features)
+            os.replace(tmp_path, path)
+        _features.update(key = version, features = features)
+        return features
+
+def compute_predictions(models, month, trees, cars, chunk = RASTER_CHUNK):
+    # Predicción de todas las celdas para un mes: una fila por contaminante
+    weather = climatology()
+    months = np.full(min(chunk, len(trees)), month)
+    predictions = np.empty((len(models), len(trees)), dtype = np.float32)
+    for i in range(0, len(trees), chunk):
+        n = len(trees[i:i + chunk])
+        predictions[:, i:i + n] = predict_all(models, batch_inputs(weather, months[:n], trees[i:i + n], cars[i:i + n]))
+    return predictions
+
+def raster_version():
+    return "|".join([features_version(), dataset_version("model"), dataset_version("month-weather")])
+
+def get_raster(models, month):
+    """
+    Predictions of every pollutant on the grid for a month, as a dict
+    with the cell centers (lon, lat) and one (lat x lon) array per label
+    """
+    features = get_features()
+    key = (raster_version(), month)
+    with _lock:
+        metrics.cache("raster_predictions", key in _predictions)
+        if key not in _predictions:
+            # Solo se guardan los meses de la versión actual
+            for old in [k for k in _predictions if k[0] != key[0]]:
+                del _predictions[old]
+            predictions = compute_predictions(models, month, features["trees"], features["cars"])
+            shape = (len(features["lat"]), len(features["lon"]))
+            _predictions[key] = {label: values.reshape(shape) for label, values in zip(models.keys(), predictions)}
+        raster = dict(_predictions[key])
+    raster.update(lon = features["lon"], lat = features["lat"])
+    return raster
+
+def colorize(values, colors, vmin = None, vmax = None, alpha = 180):
+    # Array (filas x columnas) -> Imagen RGBA con una escala lineal entre colors (hex); NaN transparente
+    rgb = np.array([[int(color[i:i + 2], 16) for i in (1, 3, 5)] for color in colors], dtype = float)
+    vmin = np.nanmin(values) if vmin is None else vmin
+    vmax = np.nanmax(values) if vmax is None else vmax
+    scaled = np.clip((values - vmin) / (vmax - vmin if vmax > vmin else 1), 0, 1)
+    stops = np.linspace(0, 1, len(colors))
+    image = np.zeros(values.shape + (4,), dtype = np.uint8)
+    for channel in range(3):
+        image[..., channel] = np.interp(np.nan_to_num(scaled), stops, rgb[:, channel]).astype(np.uint8)
+    image[..., 3] = np.where(np.isnan(values), 0, alpha)
+    return image
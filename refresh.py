@@ -0,0 +1,95 @@
+# Refresca todos los datasets en paralelo respetando las dependencias de data/metadata.txt
+# Uso (desde la raíz del proyecto): python refresh.py [max_workers]
+# Con API_URL=http://localhost:8000 se puede ejecutar contra una API local de pruebas (ver tests/fake_api.py)
+import sys
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from utils import exists, dependency_graph, acquire_lock, release_lock
+from data import last_update, download_data, update_stations
+import model
+import timeseries
+
+def refresh_levels(graph):
+    # Orden topológico por niveles: cada nivel solo depende de los anteriores
+    pending = dict(graph)
+    done = set()
+    levels = []
+    while pending:
+        level = [name for name, deps in pending.items() if all(dep in done for dep in deps)]
+        if not level:
+            raise Exception(f"Cyclic or unknown dependencies in metadata: {pending}")
+        levels.append(level)
+        done.update(level)
+        for name in level:
+            del pending[name]
+    return levels
+
+def refresh_dataset(name, deps_changed):
+    # Devuelve True si el dataset ha cambiado
+    status, info = exists(name)
+    if name == "month-weather":
+        if info[1] == "1" and not deps_changed:
+            return False
+        model.update_weather()
+        return True
+    if name == "model":
+        if info[1] == "1" and not deps_changed:
+            return False
+        lock = acquire_lock(model.TRAINING_LOCK_PATH)
+        if lock is None:
+            raise Exception("The model is being trained by another process")
+        try:
+            model.train_models(info)
+        finally:
+            release_lock(lock)
+        return True
+    api_last_update = last_update(info)
+    if datetime.strptime(info[2], "%Y-%m-%d") == api_last_update:
+        # Las estaciones no han cambiado pero sí sus dependencias -> Se recalculan sus variables
+        if name == "stations" and deps_changed:
+            update_stations()
+            return True
+        return False
+    download_data(info, api_last_update)
+    return True
+
+def timed_refresh(name, deps_changed):
+    start = time.perf_counter()
+    try:
+        changed = refresh_dataset(name, deps_changed)
+        status = "updated" if changed else "unchanged"
+        error = None
+    except Exception as e:
+        status = "failed"
+        error = str(e)
+    return {"status": status, "seconds": round(time.perf_counter() - start, 2), "error": error}
+
+def refresh_all(max_workers = 4):
+    graph = dependency_graph()
+    results = {}
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        for level in refresh_levels(graph):
+            futures = {}
+            for name in level:
+                # Si falla una dependencia no se recalculan los derivados
+                failed = [dep for dep in graph[name] if results[dep]["status"] in ["failed", "skipped"]]
+                if failed:
+                    results[name] = {"status": "skipped", "seconds": 0, "error": f"failed dependencies: {failed}"}
+                    continue
+                deps_changed = any(results[dep]["status"] == "updated" for dep in graph[name])
+                futures[name] = executor.submit(timed_refresh, name, deps_changed)
+            for name, future in futures.items():
+                results[name] = future.result()
+    if any(result["status"] == "updated" for result in results.values()):
+        timeseries.republish()
+    return results
+
+if __name__ == "__main__":
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    start = time.perf_counter()
+    results = refresh_all(max_workers)
+    for name, result in results.items():
+        error = f" ({result['error']})" if result["error"] else ""
+        print(f"{name:<20}{result['status']:<10}{result['seconds']:>8} s{error}")
+    print(f"Total: {round(time.perf_counter() - start, 2)} s")
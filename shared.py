@@ -0,0 +1,185 @@
+# Capa de datos compartida entre procesos (p.ej. workers de Gunicorn).
+# Un proceso cargador publica una instantánea inmutable (una carpeta por versión, un .npy por columna)
+# y los workers la abren memory-mapped en solo lectura: las páginas las comparte el sistema operativo.
+import os
+import json
+import shutil
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from utils import exists
+from data import get_data
+import storage
+import metrics
+
+SHARED_DIR = "data/shared"
+# Datasets que usan las páginas (weather-pollution se comparte como series por estación, ver timeseries.py)
+SHARED_DATASETS = ["stations", "trees", "month-weather"]
+KEEP_VERSIONS = 2
+# Cambia si cambia el formato de la instantánea
+SNAPSHOT_FORMAT = 2
+_attached = {}
+_pointer = {"mtime": None, "version": None}
+_lock = threading.Lock()
+
+def snapshot_version(names, extra = None):
+    # Versión a partir de metadata.txt, de los archivos locales y de la versión de los arrays extra
+    parts = [f"format@{SNAPSHOT_FORMAT}"]
+    parts += [f"{name}@{arrays['version']}" for name, arrays in (extra or {}).items() if "version" in arrays]
+    for name in names:
+        status, info = exists(name)
+        path = storage.backend_path(info[3], storage.get_backend())
+        mtime = os.path.getmtime(path) if os.path.exists(path) else 0
+        parts.append(f"{','.join(info[:3])}@{mtime}")
+    return hashlib.md5("|".join(parts).encode()).hexdigest()[:12]
+
+def frame_to_arrays(data):
+    # Numéricas y fechas -> array; texto -> categoría (códigos + valores); dict/list -> JSON
+    arrays = {}
+    columns = []
+    for column in data.columns:
+        values = data[column]
+        if values.dtype.kind in "biufM":
+            arrays[column] = values.to_numpy()
+            columns.append([column, "array"])
+        elif isinstance(storage.first_valid(values), (dict, list)):
+            arrays[column] = np.array([json.dumps(v) for v in values], dtype = str)
+            columns.append([column, "json"])
+        else:
+            codes, categories = pd.factorize(values)
+            arrays[column] = codes.astype(np.int32)
+            columns.append([column, "category", categories.tolist()])
+    return arrays, columns
+
+def arrays_to_frame(arrays, columns):
+    data = {}
+    for column in columns:
+        name, kind = column[0], column[1]
+        if kind == "array":
+            data[name] = arrays[name]
+        elif kind == "json":
+            data[name] = [json.loads(v) for v in arrays[name]]
+        else:
+            data[name] = pd.Categorical.from_codes(np.asarray(arrays[name]), categories = column[2]).astype(object)
+    # copy = False -> Las columnas numéricas siguen apuntando al memory map
+    return pd.DataFrame(data, copy = False)
+
+def write_arrays(path, arrays, meta = None):
+    os.makedirs(path, exist_ok = True)
+    for key, values in arrays.items():
+        np.save(os.path.join(path, f"{key.replace('/', '__')}.npy"), np.ascontiguousarray(values), allow_pickle = False)
+    with open(os.path.join(path, "meta.json"), "w") as file:
+        json.dump({"keys": list(arrays), "meta": meta}, file)
+
+def read_arrays(path):
+    with open(os.path.join(path, "meta.json")) as file:
+        meta = json.load(file)
+    arrays = {key: np.load(os.path.join(path, f"{key.replace('/', '__')}.npy"), mmap_mode = "r")
+              for key in meta["keys"]}
+    return arrays, meta["meta"]
+
+def publish(names = None, extra = None):
+    """
+    Write an immutable snapshot of the datasets (and any extra dict of
+    arrays) and point data/shared/current at it
+    """
+    names = names or SHARED_DATASETS
+    version = snapshot_version(names, extra)
+    path = os.path.join(SHARED_DIR, version)
+    if not os.path.exists(path):
+        tmp_path = storage.tmp_path(path)
+        for name in names:
+            # Versión de cada dataset, para detectar en attach_arrays si ha cambiado después de publicar
+            dataset_version = snapshot_version([name])
+            arrays, columns = frame_to_arrays(get_data(name))
+            write_arrays(os.path.join(tmp_path, name), arrays, {"columns": columns, "version": dataset_version})
+        for name, arrays in (extra or {}).items():
+            write_arrays(os.path.join(tmp_path, name), arrays)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Otro proceso ha publicado la misma versión a la vez
+            shutil.rmtree(tmp_path, ignore_errors = True)
+            if not os.path.exists(path):
+                raise
+    # Cambio de versión atómico
+    pointer = os.path.join(SHARED_DIR, "current")
+    tmp_path = storage.tmp_path(pointer)
+    with open(tmp_path, "w") as file:
+        file.write(version)
+    os.replace(tmp_path, pointer)
+    prune(version)
+    return version
+
+def prune(current):
+    # Conserva las últimas versiones: los workers que aún no han cambiado siguen leyendo la anterior
+    versions = [name for name in os.listdir(SHARED_DIR) if os.path.isdir(os.path.join(SHARED_DIR, name))
+                and not name.endswith(".tmp")]
+    versions.sort(key = lambda name: os.path.getmtime(os.path.join(SHARED_DIR, name)), reverse = True)
+    for version in versions[KEEP_VERSIONS:]:
+        if version != current:
+            shutil.rmtree(os.path.join(SHARED_DIR, version), ignore_errors = True)
+
+def current_version():
+    # Lee el puntero solo si ha cambiado su mtime
+    pointer = os.path.join(SHARED_DIR, "current")
+    try:
+        mtime = os.path.getmtime(pointer)
+    except OSError:
+        return None
+    if _pointer["mtime"] != mtime:
+        with open(pointer) as file:
+            _pointer["version"] = file.read().strip()
+        _pointer["mtime"] = mtime
+    return _pointer["version"]
+
+def attach_arrays(name):
+    # Arrays memory-mapped de la versión actual, None si no se ha publicado
+    # o si el dataset ha cambiado desde que se publicó
+    version = current_version()
+    if version is None:
+        return None
+    path = os.path.join(SHARED_DIR, version, name)
+    with _lock:
+        key = (version, name)
+        metrics.cache("shared", key in _attached)
+        if key not in _attached:
+            if not os.path.exists(os.path.join(path, "meta.json")):
+                return None
+            # Se descartan las versiones anteriores de este dataset
+            for old in [k for k in _attached if k[1] == name]:
+                del _attached[old]
+            _attached[key] = read_arrays(path)
+        attached = _attached[key]
+    if attached[1] is not None and attached[1]["version"] != snapshot_version([name]):
+        return None
+    return attached
+
+def attach(name):
+    # DataFrame de solo lectura desde la instantánea compartida, sino (o si está desactualizada) get_data
+    attached = attach_arrays(name)
+    if attached is None:
+        return get_data(name)
+    version = current_version()
+    key = (version, name, "frame")
+    with _lock:
+        if key not in _attached:
+            for old in [k for k in _attached if k[1] == name and len(k) == 3]:
+                del _attached[old]
+            _attached[key] = arrays_to_frame(attached[0], attached[1]["columns"])
+        return _attached[key]
+
+def memory_usage():
+    # RSS del proceso en KB, separando memoria anónima y páginas de archivo (compartibles)
+    usage = {"pid": os.getpid()}
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                key = line.split(":")[0]
+                if key in ["VmRSS", "RssAnon", "RssFile", "RssShmem"]:
+                    usage[key] = int(line.split()[1])
+    except OSError:
+        import resource
+        usage["VmRSS"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage
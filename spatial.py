@@ -0,0 +1,356 @@
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+EARTH_RADIUS = 6371 # Radio de la tierra en kilómetros
+
+def haversine_np(lon1, lat1, lon2, lat2):
+    """
+    Vectorized haversine distance in kilometers, inputs in decimal
+    degrees and broadcast with NumPy rules
+    """
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+    return c * EARTH_RADIUS
+
+def to_radians(lon, lat):
+    # BallTree con métrica haversine espera [lat, lon] en radianes
+    lon = np.asarray(lon, dtype = float).ravel()
+    lat = np.asarray(lat, dtype = float).ravel()
+    return np.radians(np.column_stack([lat, lon]))
+
+class SpatialIndex:
+    """
+    BallTree over (lon, lat) points carrying one value per point. The
+    radius is given on each query, so thresholds can change without
+    rebuilding the index.
+    """
+    def __init__(self, lon, lat, values):
+        self.tree = BallTree(to_radians(lon, lat), metric = "haversine")
+        self.lon = np.asarray(lon, dtype = float).ravel()
+        self.lat = np.asarray(lat, dtype = float).ravel()
+        self.values = np.asarray(values, dtype = float).ravel()
+
+    def query(self, lon, lat, threshold):
+        # Devuelve (fila de la consulta, índice del punto) de cada par a <= threshold km
+        ind = self.tree.query_radius(to_radians(lon, lat), threshold / EARTH_RADIUS)
+        counts = np.fromiter((len(i) for i in ind), dtype = np.int64, count = len(ind))
+        rows = np.repeat(np.arange(len(ind)), counts)
+        cols = np.concatenate(ind) if len(ind) else np.empty(0, dtype = np.int64)
+        return rows, cols.astype(np.int64)
+
+    def sum_within(self, lon, lat, threshold):
+        n = np.asarray(lon).size
+        rows, cols = self.query(lon, lat, threshold)
+        return np.bincount(rows, weights = self.values[cols], minlength = n)
+
+    def sum_within_grid(self, lon, lat, threshold, chunk = 500_000):
+        """
+        sum_within for every cell of the regular grid with centers lon x lat
+        (sorted 1-D axes), as a (lat x lon) array. In each grid row the cells
+        inside the circle of a point are a run of columns, so every point adds
+        its value to a difference array: the cost grows with points x rows
+        (chunk pairs at a time) instead of cells x points
+        """
+        lon = np.asarray(lon, dtype = float)
+        lat = np.asarray(lat, dtype = float)
+        width = len(lon) + 1
+        diff = np.zeros(len(lat) * width)
+        # Misma condición que la distancia haversine del BallTree: a <= sin²(threshold / 2R)
+        h = np.sin(threshold / EARTH_RADIUS / 2)**2
+        dlat = np.degrees(threshold / EARTH_RADIUS)
+        first = np.searchsorted(lat, self.lat - dlat, side = "left")
+        last = np.searchsorted(lat, self.lat + dlat, side = "right")
+        for start, stop in pair_chunks(last - first, chunk):
+            point, row = expand_ranges(first[start:stop], last[start:stop])
+            point += start
+            plat = np.radians(self.lat[point])
+            clat = np.radians(lat[row])
+            q = (h - np.sin((clat - plat) / 2)**2) / (np.cos(clat) * np.cos(plat))
+            inside = q >= 0
+            point, row = point[inside], row[inside]
+            half = np.degrees(2 * np.arcsin(np.sqrt(np.minimum(q[inside], 1))))
+            c0 = np.searchsorted(lon, self.lon[point] - half, side = "left")
+            c1 = np.searchsorted(lon, self.lon[point] + half, side = "right")
+            diff += np.bincount(row * width + c0, weights = self.values[point], minlength = len(diff))
+            diff -= np.bincount(row * width + c1, weights = self.values[point], minlength = len(diff))
+        return np.cumsum(diff.reshape(len(lat), width), axis = 1)[:, :-1]
+
+def pair_chunks(counts, chunk):
+    # Bloques [start, stop) de elementos consecutivos con unos chunk pares (elemento, fila) cada uno
+    total = np.cumsum(counts)
+    bounds = np.searchsorted(total, np.arange(chunk, total[-1] if len(total) else 0, chunk), side = "left") + 1
+    bounds = np.unique(np.r_[0, bounds, len(counts)])
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def expand_ranges(first, last):
+    # (elemento, valor) para cada elemento i y cada valor de first[i] a last[i] - 1
+    counts = np.maximum(last - first, 0)
+    item = np.repeat(np.arange(len(first)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return item, first[item] + offsets
+
+def build_trees_index(trees):
+    return SpatialIndex(trees["lon"], trees["lat"], trees["n"])
+
+class SegmentIndex:
+    """
+    Traffic segments flattened into one contiguous coordinate array with an
+    offsets index (the vertices of segment i are coords[offsets[i]:offsets[i+1]]).
+    Distances are true minimum point-to-polyline distances.
+    """
+    def __init__(self, coords, offsets, values, chunk_size = 2_000_000):
+        self.coords = np.asarray(coords, dtype = float)
+        self.offsets = np.asarray(offsets, dtype = np.int64)
+        self.values = np.asarray(values, dtype = float).ravel()
+        self.chunk_size = chunk_size
+        # Aristas consecutivas sin cruzar de un tramo al siguiente
+        starts = np.ones(len(self.coords) - 1, dtype = bool)
+        starts[self.offsets[1:-1] - 1] = False
+        self.edge_start = np.flatnonzero(starts)
+        edge_segment = np.searchsorted(self.offsets, self.edge_start, side = "right") - 1
+        # Primera arista de cada tramo, para reducir por tramo con reduceat
+        self.segment_edges = np.searchsorted(edge_segment, np.arange(len(self.values)))
+        a = self.coords[self.edge_start]
+        b = self.coords[self.edge_start + 1]
+        edge_length = haversine_np(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+        self.lengths = np.add.reduceat(edge_length, self.segment_edges)
+
+    def distances(self, lon, lat):
+        # Matriz (puntos x tramos) de distancias mínimas en km, por bloques de puntos
+        lon = np.asarray(lon, dtype = float).ravel()
+        lat = np.asarray(lat, dtype = float).ravel()
+        a = self.coords[self.edge_start]
+        b = self.coords[self.edge_start + 1]
+        step = max(1, self.chunk_size // max(1, len(a)))
+        result = np.empty((len(lon), len(self.values)))
+        for i in range(0, len(lon), step):
+            result[i:i + step] = self._distances(lon[i:i + step], lat[i:i + step], a, b)
+        return result
+
+    def _distances(self, lon, lat, a, b):
+        return np.minimum.reduceat(edge_distances(lon, lat, a, b), self.segment_edges, axis = 1)
+
+    def aggregate(self, lon, lat, threshold, how = "max"):
+        # Agrega los coches por hora de los tramos a <= threshold km
+        lon = np.asarray(lon, dtype = float).ravel()
+        lat = np.asarray(lat, dtype = float).ravel()
+        # Muchos puntos -> Solo se calculan las distancias a los tramos cercanos a cada punto
+        if len(lon) * len(self.edge_start) > self.chunk_size:
+            return self.aggregate_nearby(lon, lat, threshold, how)
+        near = self.distances(lon, lat) <= threshold
+        if how == "max":
+            values = np.where(near, self.values[None, :], -np.inf).max(axis = 1)
+            return np.where(np.isinf(values), 0, values)
+        # Las lecturas negativas indican que no hay dato
+        valid = near & (self.values >= 0)[None, :]
+        if how == "sum":
+            return np.where(valid, self.values[None, :], 0).sum(axis = 1)
+        if how == "mean":
+            weights = np.where(valid, self.lengths[None, :], 0)
+            total = weights.sum(axis = 1)
+            weighted = (weights * np.where(valid, self.values[None, :], 0)).sum(axis = 1)
+            return np.divide(weighted, total, out = np.zeros_like(total), where = total > 0)
+        raise Exception(f"Unknown aggregation: {how}")
+
+    def aggregate_nearby(self, lon, lat, threshold, how = "max"):
+        """
+        Same result as aggregate, but each segment only measures the points
+        inside its bounding box grown by threshold (found with a binary
+        search over the points sorted by longitude), so the cost grows with
+        the number of nearby pairs instead of points x segments
+        """
+        if how not in ["max", "sum", "mean"]:
+            raise Exception(f"Unknown aggregation: {how}")
+        order = np.argsort(lon, kind = "stable")
+        sorted_lon = lon[order]
+        k = np.pi / 180 * EARTH_RADIUS
+        # Margen en grados: en longitud depende de la latitud más alejada del ecuador
+        dlat = threshold / k
+        dlon = threshold / (k * max(np.cos(np.radians(np.abs(lat).max() + dlat)), 1e-6)) if len(lat) else 0
+        best = np.full(len(lon), -np.inf)
+        total = np.zeros(len(lon))
+        weighted = np.zeros(len(lon))
+        bounds = np.r_[self.segment_edges, len(self.edge_start)]
+        for segment in range(len(self.values)):
+            edges = self.edge_start[bounds[segment]:bounds[segment + 1]]
+            a = self.coords[edges]
+            b = self.coords[edges + 1]
+            ends = np.vstack([a, b])
+            lo, hi = np.searchsorted(sorted_lon, [ends[:, 0].min() - dlon, ends[:, 0].max() + dlon], side = "left")
+            candidates = order[lo:hi]
+            candidates = candidates[(lat[candidates] >= ends[:, 1].min() - dlat) & (lat[candidates] <= ends[:, 1].max() + dlat)]
+            if len(candidates) == 0:
+                continue
+            near = candidates[edge_distances(lon[candidates], lat[candidates], a, b).min(axis = 1) <= threshold]
+            value = self.values[segment]
+            if how == "max":
+                best[near] = np.maximum(best[near], value)
+            elif value >= 0:
+                total[near] += self.lengths[segment] if how == "mean" else 1
+                weighted[near] += value * (self.lengths[segment] if how == "mean" else 1)
+        if how == "max":
+            return np.where(np.isinf(best), 0, best)
+        if how == "sum":
+            return weighted
+        return np.divide(weighted, total, out = np.zeros_like(total), where = total > 0)
+
+    def aggregate_grid(self, lon, lat, threshold, how = "max", chunk = 1_000_000):
+        """
+        aggregate for every cell of the regular grid with centers lon x lat
+        (sorted 1-D axes), as a (lat x lon) array. Within a grid row the
+        projection of edge_distances is fixed, so the cells of the row near
+        an edge are a run of columns found in closed form (edge_runs): each
+        edge is rasterized once, about chunk (cell, segment) pairs at a time
+        """
+        if how not in ["max", "sum", "mean"]:
+            raise Exception(f"Unknown aggregation: {how}")
+        lon = np.asarray(lon, dtype = float)
+        lat = np.asarray(lat, dtype = float)
+        n_cells = len(lon) * len(lat)
+        a = self.coords[self.edge_start]
+        b = self.coords[self.edge_start + 1]
+        edge_counts = np.diff(np.r_[self.segment_edges, len(self.edge_start)])
+        edge_segment = np.repeat(np.arange(len(self.values)), edge_counts)
+        k = np.pi / 180 * EARTH_RADIUS
+        dlat = threshold / k
+        dlon = threshold / (k * max(np.cos(np.radians(np.abs(lat).max() + dlat)), 1e-6)) if len(lat) else 0
+        # Filas y columnas del rectángulo de cada arista ampliado en threshold (cota de los pares)
+        first = np.searchsorted(lat, np.minimum(a[:, 1], b[:, 1]) - dlat, side = "left")
+        last = np.searchsorted(lat, np.maximum(a[:, 1], b[:, 1]) + dlat, side = "right")
+        columns = (np.searchsorted(lon, np.maximum(a[:, 0], b[:, 0]) + dlon, side = "right")
+                   - np.searchsorted(lon, np.minimum(a[:, 0], b[:, 0]) - dlon, side = "left"))
+        pairs = np.add.reduceat((last - first) * columns, self.segment_edges) if len(self.values) else np.empty(0)
+        best = np.full(n_cells, -np.inf)
+        total = np.zeros(n_cells)
+        weighted = np.zeros(n_cells)
+        # Bloques de tramos enteros: un tramo no se cuenta dos veces en la misma celda
+        bounds = np.r_[self.segment_edges, len(self.edge_start)]
+        for start, stop in pair_chunks(pairs, chunk):
+            edge, row = expand_ranges(first[bounds[start]:bounds[stop]], last[bounds[start]:bounds[stop]])
+            edge += bounds[start]
+            c0, c1 = edge_runs(lon, lat[row], a[edge], b[edge], threshold)
+            item, column = expand_ranges(c0, c1)
+            cell = row[item] * len(lon) + column
+            segment = edge_segment[edge[item]]
+            if how == "max":
+                np.maximum.at(best, cell, self.values[segment])
+                continue
+            key = np.unique(segment * n_cells + cell)
+            segment, cell = key // n_cells, key % n_cells
+            # Las lecturas negativas indican que no hay dato
+            valid = self.values[segment] >= 0
+            weights = self.lengths[segment[valid]] if how == "mean" else np.ones(valid.sum())
+            total += np.bincount(cell[valid], weights = weights, minlength = n_cells)
+            weighted += np.bincount(cell[valid], weights = weights * self.values[segment[valid]], minlength = n_cells)
+        if how == "max":
+            result = np.where(np.isinf(best), 0, best)
+        elif how == "sum":
+            result = weighted
+        else:
+            result = np.divide(weighted, total, out = np.zeros_like(total), where = total > 0)
+        return result.reshape(len(lat), len(lon))
+
+def edge_distances(lon, lat, a, b):
+    # Matriz (puntos x aristas) de distancias en km de cada punto a cada arista [a, b]
+    # Proyección equirectangular local centrada en cada punto (precisa a escala de ciudad)
+    k = np.pi / 180 * EARTH_RADIUS
+    scale = np.cos(np.radians(lat))[:, None] * k
+    ax = (a[:, 0][None, :] - lon[:, None]) * scale
+    ay = (a[:, 1][None, :] - lat[:, None]) * k
+    dx = (b[:, 0] - a[:, 0])[None, :] * scale
+    dy = np.broadcast_to((b[:, 1] - a[:, 1])[None, :] * k, dx.shape)
+    norm = dx**2 + dy**2
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        t = np.where(norm > 0, -(ax*dx + ay*dy) / norm, 0)
+    t = np.clip(t, 0, 1)
+    return np.hypot(ax + t*dx, ay + t*dy)
+
+def edge_runs(lon, lat, a, b, threshold):
+    """
+    Columns [c0, c1) of the sorted axis lon at distance <= threshold km of
+    each edge [a, b] on the grid row at lat, with the projection of
+    edge_distances. The cells near an edge form a capsule (two discs and
+    the band between them), convex, so on a row they are a single run
+    """
+    k = np.pi / 180 * EARTH_RADIUS
+    scale = np.cos(np.radians(lat)) * k
+    # Coordenadas en km: x = lon * scale, y relativa a la fila
+    ax, ay = a[:, 0] * scale, (a[:, 1] - lat) * k
+    bx, by = b[:, 0] * scale, (b[:, 1] - lat) * k
+    dx, dy = bx - ax, by - ay
+    norm = dx**2 + dy**2
+    length = np.sqrt(norm)
+    lo = np.full(len(lat), np.inf)
+    hi = np.full(len(lat), -np.inf)
+    # Círculos en los extremos
+    for x, y in [(ax, ay), (bx, by)]:
+        inside = np.abs(y) <= threshold
+        half = np.sqrt(np.maximum(threshold**2 - y**2, 0))
+        lo = np.where(inside, np.minimum(lo, x - half), lo)
+        hi = np.where(inside, np.maximum(hi, x + half), hi)
+    # Banda entre ambos: proyección sobre la arista en [0, 1] y distancia a la recta <= threshold
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        t0, t1 = ax + ay*dy / dx, ax + (ay*dy + norm) / dx
+        p0, p1 = ax + (-threshold*length - ay*dx) / dy, ax + (threshold*length - ay*dx) / dy
+    all_t = (ay*dy <= 0) & (ay*dy + norm >= 0)
+    band_lo = np.maximum(np.where(dx != 0, np.minimum(t0, t1), np.where(all_t, -np.inf, np.inf)),
+                         np.where(dy != 0, np.minimum(p0, p1), np.where(np.abs(ay*dx) <= threshold*length, -np.inf, np.inf)))
+    band_hi = np.minimum(np.where(dx != 0, np.maximum(t0, t1), np.where(all_t, np.inf, -np.inf)),
+                         np.where(dy != 0, np.maximum(p0, p1), np.where(np.abs(ay*dx) <= threshold*length, np.inf, -np.inf)))
+    band = (norm > 0) & (band_lo <= band_hi)
+    lo = np.where(band, np.minimum(lo, band_lo), lo)
+    hi = np.where(band, np.maximum(hi, band_hi), hi)
+    c0 = np.searchsorted(lon, lo / scale, side = "left")
+    c1 = np.searchsorted(lon, hi / scale, side = "right")
+    return c0, np.maximum(c1, c0)
+
+def flatten_segments(traffic):
+    # Aplana todas las polilíneas en un array de coordenadas contiguo con su índice de offsets
+    lines = [np.asarray(dict(shape)["geometry"]["coordinates"], dtype = float).reshape(-1, 2)
+             for shape in traffic["geo_shape"]]
+    # Un tramo de un solo punto se trata como una arista de longitud cero
+    lines = [np.vstack([line, line]) if len(line) == 1 else line for line in lines]
+    offsets = np.zeros(len(lines) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(line) for line in lines])
+    coords = np.concatenate(lines) if lines else np.empty((0, 2))
+    return coords, offsets
+
+def build_traffic_index(traffic):
+    coords, offsets = flatten_segments(traffic)
+    return SegmentIndex(coords, offsets, traffic["cars_per_hour"])
+
+def tree_density(lon, lat, trees_index, threshold = 1):
+    # Árboles por km² en un radio de threshold km
+    n_trees = trees_index.sum_within(lon, lat, threshold)
+    area = np.pi * threshold**2
+    return n_trees/area
+
+def traffic_per_day(lon, lat, traffic_index, threshold = 0.5, how = "max"):
+    # Coches por hora de los tramos cercanos ("max", "sum" o "mean" ponderada por longitud), por 24 horas
+    return traffic_index.aggregate(lon, lat, threshold, how)*24
+
+def tree_density_grid(lon, lat, trees_index, threshold = 1):
+    # tree_density de cada celda de la malla lon x lat, como array (lat x lon)
+    n_trees = trees_index.sum_within_grid(lon, lat, threshold)
+    area = np.pi * threshold**2
+    return n_trees/area
+
+def traffic_per_day_grid(lon, lat, traffic_index, threshold = 0.5, how = "max"):
+    # traffic_per_day de cada celda de la malla lon x lat, como array (lat x lon)
+    return traffic_index.aggregate_grid(lon, lat, threshold, how)*24
+
+def calculate_features(lon, lat, trees, traffic, trees_threshold = 1, traffic_threshold = 0.5, traffic_how = "max"):
+    # Calcula densidad de árboles y tráfico para N puntos en una sola llamada
+    trees_index = trees if isinstance(trees, SpatialIndex) else build_trees_index(trees)
+    traffic_index = traffic if isinstance(traffic, SegmentIndex) else build_traffic_index(traffic)
+    features = pd.DataFrame({
+        "lon": np.asarray(lon, dtype = float).ravel(),
+        "lat": np.asarray(lat, dtype = float).ravel()
+    })
+    features["trees"] = tree_density(lon, lat, trees_index, trees_threshold)
+    features["cars_per_day"] = traffic_per_day(lon, lat, traffic_index, traffic_threshold, traffic_how)
+    return features
@@ -0,0 +1,43 @@
+# Tiempos de arranque por fase y precarga de las páginas en segundo plano
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# WARM_UP=0 -> Los datos de cada página se cargan en su primera visita
+WARM_UP = os.environ.get("WARM_UP", "1") == "1"
+timings = {}
+_start = time.perf_counter()
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - start, 3)
+
+def report():
+    # Tiempos de cada fase y desde el inicio del proceso
+    timings["total"] = round(time.perf_counter() - _start, 3)
+    print("Startup times:")
+    for name, seconds in timings.items():
+        print(f"  {name:<30}{seconds:>8.3f} s")
+    return timings
+
+def warm_up(loaders, background = True):
+    # loaders: {fase: función}. En segundo plano el servidor ya responde mientras se cargan
+    def run():
+        for name, loader in loaders.items():
+            try:
+                with phase(name):
+                    loader()
+            except Exception as e:
+                print(f"Warm-up of {name} failed: {e}")
+        report()
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+    return thread
@@ -0,0 +1,153 @@
+import os
+import json
+import threading
+import pandas as pd
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Formato del almacén local: "feather" (Arrow IPC sin comprimir, memory-mapped) o "json"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "feather" if pa is not None else "json")
+# Extensión añadida a los JSON ya migrados a otro backend
+MIGRATED_SUFFIX = ".migrated"
+
+def first_valid(column):
+    index = column.first_valid_index()
+    return None if index is None else column[index]
+
+class JSONBackend:
+    extension = ".json"
+
+    def write(self, data, path):
+        data.to_json(path, indent = 4, orient = "records")
+
+    def read(self, path):
+        return pd.read_json(path)
+
+    def write_chunks(self, chunks, path):
+        # Escribe los bloques según llegan en un único array JSON
+        with open(path, "w") as file:
+            file.write("[")
+            first = True
+            for chunk in chunks:
+                if chunk.empty:
+                    continue
+                records = chunk.to_json(indent = 4, orient = "records").strip()[1:-1].strip()
+                if not first:
+                    file.write(",")
+                file.write("\n    " + records)
+                first = False
+            file.write("\n]")
+
+class FeatherBackend:
+    extension = ".feather"
+
+    def to_table(self, data, schema = None):
+        # Las columnas con dict/list (p.ej. geo_shape) se guardan como texto JSON
+        data = data.copy()
+        json_columns = [column for column in data.columns
+                        if data[column].dtype == object and isinstance(first_valid(data[column]), (dict, list))]
+        for column in json_columns:
+            data[column] = data[column].map(json.dumps)
+        # Categorías como texto: un archivo IPC solo admite un diccionario por columna y cada bloque trae el suyo
+        for column in data.columns[data.dtypes == "category"]:
+            data[column] = data[column].astype(object)
+        table = pa.Table.from_pandas(data, schema = schema, preserve_index = False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"json_columns"] = json.dumps(json_columns).encode()
+        return table.replace_schema_metadata(metadata)
+
+    def write(self, data, path):
+        table = self.to_table(data)
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    def read(self, path):
+        # Memory-mapped: las columnas numéricas no se copian al leer
+        with pa.memory_map(path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        data = table.to_pandas(split_blocks = True)
+        json_columns = json.loads((table.schema.metadata or {}).get(b"json_columns", b"[]"))
+        for column in json_columns:
+            data[column] = data[column].map(json.loads)
+        return data
+
+    def write_chunks(self, chunks, path):
+        writer = None
+        with pa.OSFile(path, "wb") as sink:
+            for chunk in chunks:
+                if chunk.empty:
+                    continue
+                if writer is None:
+                    table = self.to_table(chunk)
+                    schema = table.schema
+                    writer = pa.ipc.new_file(sink, schema)
+                else:
+                    table = self.to_table(chunk, schema)
+                writer.write_table(table)
+            if writer is None:
+                raise Exception(f"No data to write in {path}")
+            writer.close()
+
+BACKENDS = {"json": JSONBackend, "feather": FeatherBackend}
+
+def get_backend(name = None):
+    name = name or STORAGE_BACKEND
+    if name not in BACKENDS:
+        raise Exception(f"Unknown storage backend: {name}")
+    if name == "feather" and pa is None:
+        raise Exception("The feather backend needs pyarrow")
+    return BACKENDS[name]()
+
+def backend_path(path, backend):
+    # La ruta de metadata.txt es lógica: la extensión depende del backend
+    return os.path.splitext(path)[0] + backend.extension
+
+def tmp_path(path, suffix = ".tmp"):
+    # Temporal único por proceso e hilo, para escribir y luego renombrar con os.replace
+    return f"{path}.{os.getpid()}.{threading.get_ident()}{suffix}"
+
+def exists(path, backend = None):
+    backend = backend or get_backend()
+    return os.path.exists(backend_path(path, backend)) or os.path.exists(path)
+
+def write(data, path, backend = None):
+    backend = backend or get_backend()
+    path = backend_path(path, backend)
+    # Escribe en un temporal y lo renombra para que los lectores nunca vean el archivo a medias
+    tmp = tmp_path(path)
+    backend.write(data, tmp)
+    os.replace(tmp, path)
+
+def write_chunks(chunks, path, backend = None):
+    backend = backend or get_backend()
+    path = backend_path(path, backend)
+    tmp = tmp_path(path)
+    try:
+        backend.write_chunks(chunks, tmp)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+def read(path, backend = None):
+    backend = backend or get_backend()
+    store_path = backend_path(path, backend)
+    if os.path.exists(store_path):
+        return backend.read(store_path)
+    # Primera carga con otro backend -> Migrar el JSON existente
+    if not os.path.exists(path):
+        raise Exception(f"The file {path} does not exist")
+    data = JSONBackend().read(path)
+    write(data, path, backend)
+    # Ya migrado: el JSON se conserva con otro nombre y no se vuelve a leer
+    if store_path != path:
+        try:
+            os.replace(path, path + MIGRATED_SUFFIX)
+        except FileNotFoundError:
+            # Otro proceso lo ha migrado a la vez
+            pass
+    return data
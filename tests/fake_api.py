@@ -0,0 +1,59 @@
+# API local de pruebas con la forma de la API de datos abiertos de Valencia (opendatasoft):
+# fecha de modificación de cada dataset y su export JSON.
+# Uso: with FakeAPI({"arbratge-arbolado": ("2024-06-01", records)}) as api: data.API_URL = api.url
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+class FakeAPI:
+    def __init__(self, datasets):
+        # id del dataset -> (fecha de modificación "YYYY-MM-DD", registros del export)
+        self.datasets = datasets
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = api.respond(self.path)
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, path):
+        url = urlparse(path)
+        parts = url.path.strip("/").split("/")
+        if parts[0] == "catalogo-de-datos-abiertos":
+            # where=dataset_id="<id>"
+            id_name = parse_qs(url.query)["where"][0].split('"')[1]
+            kind = "info"
+        else:
+            id_name = parts[0]
+            kind = "json" if parts[1:] == ["exports", "json"] else None
+        with self._lock:
+            self.requests.append((kind, id_name))
+        if id_name not in self.datasets or kind is None:
+            return 404, {"error": "unknown dataset"}
+        modified, records = self.datasets[id_name]
+        if kind == "info":
+            return 200, {"results": [{"modified": f"{modified}T00:00:00+00:00"}]}
+        return 200, records
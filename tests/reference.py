@@ -0,0 +1,28 @@
+# Implementaciones anteriores del preprocesado de download_data (lambdas por fila y un filtro por estación):
+# referencia para tests/test_preprocessing.py y benchmarks/preprocessing.py
+import pandas as pd
+from data import STATION_NAMES
+
+def legacy_trees(data_raw):
+    data = data_raw[["nom_comu_c"]].copy()
+    data["lon"]  = data_raw["geo_point_2d"].apply(lambda x: dict(x)["lon"])
+    data["lat"]  = data_raw["geo_point_2d"].apply(lambda x: dict(x)["lat"])
+    data["lon"] = data["lon"].round(3)
+    data["lat"] = data["lat"].round(3)
+    data = data.groupby(["lon", "lat"]).count().reset_index()
+    data = data[["lon", "lat", "nom_comu_c"]]
+    data.columns = ["lon", "lat", "n"]
+    return data
+
+def legacy_points(data_raw):
+    return (data_raw["geo_point_2d"].apply(lambda x: dict(x)["lon"]),
+            data_raw["geo_point_2d"].apply(lambda x: dict(x)["lat"]))
+
+def legacy_means(names, weather_pollution):
+    co, so2, pm = [], [], []
+    for name in names:
+        station_data = weather_pollution[weather_pollution["station"] == STATION_NAMES[name]]
+        co.append(station_data["co"].mean())
+        so2.append(station_data["so2"].mean())
+        pm.append(station_data["pm2_5"].mean())
+    return pd.DataFrame({"co": co, "so2": so2, "pm": pm})
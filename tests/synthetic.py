@@ -0,0 +1,44 @@
+# Datos sintéticos compartidos por los tests y los benchmarks (benchmarks/suite.py, benchmarks/preprocessing.py):
+# weather-pollution no está en el repositorio y los árboles y tramos se escalan con copias desplazadas.
+# Uso: from synthetic import ... (tests) / from tests.synthetic import ... (benchmarks)
+import numpy as np
+import pandas as pd
+from data import STATION_NAMES, MEASURES, DATE_RANGE, apply_schema
+
+def synthetic_weather_pollution(rng, scale = 1, start = DATE_RANGE[0], end = DATE_RANGE[1]):
+    # Una fila diaria por estación entre start y end, con un 20% de valores vacíos como los datos de la API,
+    # más scale - 1 copias con ruido
+    stations = [name for name in STATION_NAMES.values() if name]
+    dates = pd.date_range(start, end, freq = "D", inclusive = "left")
+    data = pd.DataFrame({"station": np.repeat(stations, len(dates)), "date": np.tile(dates, len(stations))})
+    for column in MEASURES:
+        values = rng.gamma(2, 5, len(data))
+        values[rng.random(len(data)) < 0.2] = np.nan
+        data[column] = values
+    copies = [data] + [data.assign(**{column: data[column] * rng.uniform(0.9, 1.1) for column in MEASURES})
+                       for _ in range(scale - 1)]
+    return apply_schema("weather-pollution", pd.concat(copies, ignore_index = True))
+
+def synthetic_trees(rng, n):
+    # Registros de la API de árboles repartidos por Valencia, algunos sin nombre
+    lon = rng.uniform(-0.43, -0.32, n)
+    lat = rng.uniform(39.42, 39.51, n)
+    names = np.where(rng.random(n) < 0.05, None, rng.choice(["Platanus", "Citrus", "Melia", "Washingtonia"], n))
+    return pd.DataFrame({"nom_comu_c": names, "geo_point_2d": [{"lon": a, "lat": b} for a, b in zip(lon, lat)]})
+
+def scale_trees(rng, trees, scale):
+    # trees (preprocesado) más scale - 1 copias desplazadas
+    copies = [trees] + [trees.assign(lon = (trees["lon"] + rng.uniform(-0.02, 0.02)).round(3),
+                                     lat = (trees["lat"] + rng.uniform(-0.02, 0.02)).round(3)) for _ in range(scale - 1)]
+    return pd.concat(copies, ignore_index = True)
+
+def scale_traffic(rng, traffic, scale):
+    # traffic (preprocesado) más scale - 1 copias de los tramos desplazadas, con ids distintos
+    copies = [traffic]
+    for i in range(scale - 1):
+        dlon, dlat = rng.uniform(-0.02, 0.02, 2)
+        shapes = [{"type": "Feature", "geometry": {"type": "LineString", "coordinates":
+                   [[x + dlon, y + dlat] for x, y in np.asarray(shape["geometry"]["coordinates"]).reshape(-1, 2).tolist()]}}
+                  for shape in traffic["geo_shape"]]
+        copies.append(traffic.assign(id = traffic["id"].astype(str) + f"-{i + 1}", geo_shape = shapes))
+    return pd.concat(copies, ignore_index = True)
@@ -0,0 +1,58 @@
+import os
+import time
+import numpy as np
+import pytest
+import data
+import storage
+from utils import exists
+from synthetic import synthetic_weather_pollution
+from workspace import copy_data
+
+FILES = ["metadata.txt", "trees.json", "traffic.json", "stations.json", "month-weather.json"]
+# Cuerpo de la petición que hace el navegador al hacer zoom en el gráfico de meteorología
+BODY = {"output": "weather_plot.figure", "outputs": {"id": "weather_plot", "property": "figure"},
+        "inputs": [{"id": "stations_selector", "property": "value", "value": ["Viveros"]},
+                   {"id": "measure_weather_selector", "property": "value", "value": "Temperature"},
+                   {"id": "weather_plot", "property": "relayoutData",
+                    "value": {"xaxis.range[0]": "2015-01-01", "xaxis.range[1]": "2015-03-01"}}],
+        "changedPropIds": ["weather_plot.relayoutData"], "state": []}
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # Copia de los datos en un directorio temporal: los trabajos y sus bloqueos se guardan en data/cache
+    copy_data(tmp_path, FILES)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(data, "REFRESH_MODE", "offline")
+    status, info = exists("weather-pollution")
+    storage.write(synthetic_weather_pollution(np.random.default_rng(0)), info[3])
+    return tmp_path
+
+def test_heavy_callback_through_diskcache_manager(workspace):
+    pytest.importorskip("diskcache")
+    # Solo se puede importar una vez: registra la aplicación y los callbacks (y crea el DiskcacheManager)
+    import index
+    import background
+    assert background.manager is not None
+    client = index.server.test_client()
+    response = client.post("/_dash-update-component", json = BODY)
+    assert response.status_code == 200
+    job = response.get_json()
+    # El navegador consulta el trabajo hasta que hay respuesta (el progreso llega en cualquiera de las consultas)
+    progress = []
+    for _ in range(200):
+        response = client.post(f"/_dash-update-component?cacheKey={job['cacheKey']}&job={job['job']}", json = BODY)
+        assert response.status_code == 200
+        result = response.get_json()
+        progress += [result["progress"]] if "progress" in result else []
+        if "response" in result:
+            break
+        time.sleep(0.3)
+    else:
+        pytest.fail("The background job did not finish")
+    # Progreso enviado con report() desde el proceso del trabajo
+    assert {"weather_progress.value": 1, "weather_progress.max": 2} in progress
+    # triggered_id en el proceso del trabajo: se aplica el zoom del propio gráfico
+    x = [value for trace in result["response"]["weather_plot"]["figure"]["data"] for value in trace["x"]]
+    assert min(x)[:10] == "2015-01-01" and max(x)[:10] == "2015-03-01"
+    # Bloqueo del trabajo con el pid del worker (este proceso), no con el del proceso hijo
+    assert os.path.exists(os.path.join(background.SLOTS_DIR, f"{os.getpid()}-0.lock"))
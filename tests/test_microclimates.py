@@ -0,0 +1,32 @@
+import os
+import pytest
+import data
+import metadata
+import storage
+from datetime import datetime
+from utils import exists
+from workspace import copy_data
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # Copia de los datos en un directorio temporal: el mapa se guarda en data/cache
+    copy_data(tmp_path, ["metadata.txt", "stations.json", "trees.json"])
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(data, "REFRESH_MODE", "offline")
+    return tmp_path
+
+def test_map_changes_when_stations_are_rewritten(workspace):
+    import pages.microclimates as microclimates
+    url = microclimates.get_map()
+    # Mismo día en metadata.txt, como update_stations y update_aggregates
+    status, info = exists("stations")
+    stations = storage.read(info[3])
+    stations["cars_per_day"] = stations["cars_per_day"] + 1000
+    storage.write(stations, info[3])
+    metadata.record_update("stations", datetime.strptime(info[2], "%Y-%m-%d"), stations)
+    assert exists("stations")[1][2] == info[2]
+    new_url = microclimates.get_map()
+    assert new_url != url
+    path = microclimates.map_cache[new_url.split("-")[-1].split(".")[0]]
+    with open(path, encoding = "utf-8") as file:
+        assert f"{stations['cars_per_day'].iloc[0]:,}" in file.read()
@@ -0,0 +1,26 @@
+# Mismo resultado que el preprocesado anterior (tests/reference.py), con datos pequeños
+import numpy as np
+import pandas as pd
+from data import preprocess_trees, station_means, extract_points, STATION_NAMES
+from reference import legacy_trees, legacy_points, legacy_means
+from synthetic import synthetic_trees, synthetic_weather_pollution
+
+def test_trees_match_legacy():
+    trees_raw = synthetic_trees(np.random.default_rng(0), 20000)
+    pd.testing.assert_frame_equal(preprocess_trees(trees_raw), legacy_trees(trees_raw), check_exact = True)
+
+def test_coordinates_match_legacy():
+    trees_raw = synthetic_trees(np.random.default_rng(1), 5000)
+    lon, lat = legacy_points(trees_raw)
+    coords = extract_points(trees_raw["geo_point_2d"])
+    assert np.array_equal(coords["lon"].to_numpy(), lon.to_numpy())
+    assert np.array_equal(coords["lat"].to_numpy(), lat.to_numpy())
+
+def test_station_means_match_legacy():
+    weather_pollution = synthetic_weather_pollution(np.random.default_rng(0), scale = 3)
+    # Medidas en float64 (como los datos sin esquema) para comparar con rtol = 1e-12
+    weather_pollution = weather_pollution.astype({column: "float64" for column in ["co", "so2", "pm2_5"]})
+    names = list(STATION_NAMES)
+    # La suma del groupby puede diferir en el último bit frente a Series.mean
+    pd.testing.assert_frame_equal(station_means(names, weather_pollution), legacy_means(names, weather_pollution),
+                                  check_exact = False, rtol = 1e-12)
@@ -0,0 +1,35 @@
+import numpy as np
+import storage
+import raster
+from synthetic import scale_trees, scale_traffic
+from workspace import data_path
+from spatial import build_trees_index, build_traffic_index, tree_density, traffic_per_day, traffic_per_day_grid
+
+def datasets(scale = 1, seed = 0):
+    # Árboles y tramos del repositorio más scale - 1 copias desplazadas
+    rng = np.random.default_rng(seed)
+    # Lectura directa del JSON: storage.read lo migraría (y renombraría) dentro del repositorio
+    trees = storage.JSONBackend().read(data_path("trees.json"))
+    traffic = storage.JSONBackend().read(data_path("traffic.json"))
+    return scale_trees(rng, trees, scale), scale_traffic(rng, traffic, scale)
+
+def test_grid_features_match_per_cell():
+    trees, traffic = datasets()
+    trees_index, traffic_index = build_trees_index(trees), build_traffic_index(traffic)
+    lon, lat = raster.raster_grid(raster.raster_bounds(trees), cells = 5000)
+    cell_lon, cell_lat = np.meshgrid(lon, lat)
+    cell_lon, cell_lat = cell_lon.ravel(), cell_lat.ravel()
+    density, cars = raster.compute_features(lon, lat, trees_index, traffic_index)
+    np.testing.assert_array_equal(density, tree_density(cell_lon, cell_lat, trees_index).astype(np.float32))
+    np.testing.assert_array_equal(cars, traffic_per_day(cell_lon, cell_lat, traffic_index).astype(np.float32))
+    for how in ["sum", "mean"]:
+        np.testing.assert_allclose(traffic_per_day_grid(lon, lat, traffic_index, how = how).ravel(),
+                                   traffic_per_day(cell_lon, cell_lat, traffic_index, how = how), rtol = 1e-12)
+
+def test_features_at_100x_scale():
+    # Tiempo y memoria a esta escala: benchmarks/raster.py
+    trees, traffic = datasets(scale = 100)
+    lon, lat = raster.raster_grid(raster.raster_bounds(trees), cells = 100000)
+    density, cars = raster.compute_features(lon, lat, build_trees_index(trees), build_traffic_index(traffic))
+    assert len(density) == len(cars) == len(lon) * len(lat) >= 95000
+    assert density.max() > 0 and cars.max() > 0
@@ -0,0 +1,71 @@
+import os
+import threading
+import numpy as np
+import pytest
+import data
+import model
+import refresh
+import storage
+from utils import exists, dependency_graph
+from fake_api import FakeAPI
+from synthetic import synthetic_weather_pollution
+from workspace import copy_data
+
+FILES = ["metadata.txt", "trees.json", "traffic.json", "stations.json", "month-weather.json"]
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # Copia de los datos en un directorio temporal: refresh_all escribe en data/
+    copy_data(tmp_path, FILES)
+    monkeypatch.chdir(tmp_path)
+    status, info = exists("weather-pollution")
+    storage.write(synthetic_weather_pollution(np.random.default_rng(0), start = "2019-01-01", end = "2019-04-01"), info[3])
+    return tmp_path
+
+def test_refresh_order_and_dependencies(workspace, monkeypatch):
+    stations = storage.read(exists("stations")[1][3])
+    # Árboles nuevos junto a cada estación, el resto de datasets sin cambios en la API
+    trees = [{"geo_point_2d": {"lon": lon, "lat": lat}, "nom_comu_c": "Platanus"}
+             for lon, lat in zip(stations["lon"], stations["lat"]) for _ in range(50)]
+    datasets = {info[1]: (info[2], []) for name, info in ((name, exists(name)[1]) for name in dependency_graph())}
+    datasets[exists("trees")[1][1]] = ("2024-06-01", trees)
+
+    events = []
+    lock = threading.Lock()
+    refresh_dataset = refresh.refresh_dataset
+
+    def traced(name, deps_changed):
+        with lock:
+            events.append(("start", name))
+        try:
+            return refresh_dataset(name, deps_changed)
+        finally:
+            with lock:
+                events.append(("end", name))
+
+    trained = []
+    monkeypatch.setattr(refresh, "refresh_dataset", traced)
+    monkeypatch.setattr(model, "train_models", lambda info: trained.append(info[0]))
+    with FakeAPI(datasets) as api:
+        monkeypatch.setattr(data, "API_URL", api.url)
+        results = refresh.refresh_all()
+
+    graph = dependency_graph()
+    assert refresh.refresh_levels(graph) == [["trees", "traffic", "weather-pollution"], ["stations", "month-weather"], ["model"]]
+    # Cada dataset empieza después de que terminen todas sus dependencias
+    for name, deps in graph.items():
+        for dep in deps:
+            assert events.index(("end", dep)) < events.index(("start", name))
+    assert {name: result["status"] for name, result in results.items()} == {
+        "trees": "updated", "traffic": "unchanged", "weather-pollution": "unchanged",
+        "stations": "updated", "month-weather": "unchanged", "model": "updated"}
+    assert ("json", exists("trees")[1][1]) in api.requests
+    # Las estaciones no se descargan: se recalculan sus variables con los árboles nuevos
+    assert ("json", exists("stations")[1][1]) not in api.requests
+    assert exists("trees")[1][2] == "2024-06-01"
+    assert exists("stations")[1][2] == "2023-09-19"
+    updated = storage.read(exists("stations")[1][3])
+    assert (updated["trees"] > 0).all()
+    assert not np.allclose(updated["trees"], stations["trees"])
+    assert updated["co"].notna().sum() == stations["name"].map(data.STATION_NAMES).astype(bool).sum()
+    assert trained == ["model"]
@@ -0,0 +1,17 @@
+import os
+import pandas as pd
+import pytest
+import storage
+
+def test_json_is_renamed_after_migration(tmp_path):
+    pytest.importorskip("pyarrow")
+    backend = storage.get_backend("feather")
+    path = str(tmp_path / "trees.json")
+    data = pd.DataFrame({"lon": [-0.375, -0.371], "lat": [39.47, 39.48], "n": [3, 5]})
+    storage.JSONBackend().write(data, path)
+    pd.testing.assert_frame_equal(storage.read(path, backend), data)
+    # Se lee desde el backend y el JSON queda con otro nombre
+    assert os.path.exists(storage.backend_path(path, backend))
+    assert not os.path.exists(path)
+    assert os.path.exists(path + storage.MIGRATED_SUFFIX)
+    pd.testing.assert_frame_equal(storage.read(path, backend), data)
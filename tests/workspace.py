@@ -0,0 +1,17 @@
+# Datos del repositorio para los tests que escriben en data/: se copian a un directorio temporal.
+# Los JSON de data/ pueden estar ya migrados al backend de almacenamiento (storage.read los renombra).
+import os
+import shutil
+import storage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def data_path(name):
+    # Ruta del archivo name de data/, también si ya se ha migrado
+    path = os.path.join(ROOT, "data", name)
+    return path if os.path.exists(path) else path + storage.MIGRATED_SUFFIX
+
+def copy_data(directory, names):
+    os.makedirs(os.path.join(directory, "data"))
+    for name in names:
+        shutil.copy(data_path(name), os.path.join(directory, "data", name))
@@ -0,0 +1,237 @@
+import os
+import numpy as np
+import pandas as pd
+from utils import exists
+from data import get_data
+import storage
+import shared
+
+# Niveles de resolución, del más fino al más grueso
+LEVELS = {"raw": None, "daily": "D", "weekly": "W", "monthly": "MS"}
+TARGET_POINTS = 1000
+# Formato de los stores guardados (forma parte de su versión)
+STORE_FORMAT = 2
+DOWNSAMPLING = "lttb"
+STORE_DIR = "data/cache"
+
+class StationStore:
+    """
+    Time series partitioned by station and sorted by date. Each station
+    is a contiguous [start, stop) block of the column arrays, so slicing
+    a station is O(1) and a date range is a binary search; both return
+    NumPy views.
+    """
+    def __init__(self, stations, starts, stops, dates, columns):
+        self.stations = list(stations)
+        self.offsets = {station: (int(a), int(b)) for station, a, b in zip(self.stations, starts, stops)}
+        self.dates = dates
+        self.columns = columns
+
+    @classmethod
+    def from_frame(cls, data, order = None):
+        # order: orden de las estaciones (por defecto, orden de aparición)
+        order = list(pd.unique(data["station"])) if order is None else list(order)
+        data = data.sort_values(["station", "date"], kind = "stable")
+        names = data["station"].to_numpy()
+        bounds = np.flatnonzero(np.r_[True, names[1:] != names[:-1], True]) if len(names) else np.array([0])
+        blocks = {names[a]: (a, b) for a, b in zip(bounds[:-1], bounds[1:])}
+        order = [station for station in order if station in blocks]
+        # Medidas en float32, como en el esquema de weather-pollution
+        columns = {column: np.ascontiguousarray(data[column].to_numpy(dtype = np.float32))
+                   for column in data.columns if column not in ["station", "date"]}
+        dates = np.ascontiguousarray(data["date"].to_numpy().astype("datetime64[ns]"))
+        return cls(order, [blocks[s][0] for s in order], [blocks[s][1] for s in order], dates, columns)
+
+    def slice(self, station, start = None, end = None):
+        a, b = self.offsets.get(station, (0, 0))
+        if start is not None:
+            a = a + int(np.searchsorted(self.dates[a:b], np.datetime64(start, "ns"), side = "left"))
+        if end is not None:
+            b = a + int(np.searchsorted(self.dates[a:b], np.datetime64(end, "ns"), side = "right"))
+        return a, b
+
+    def get(self, station, measure, start = None, end = None):
+        a, b = self.slice(station, start, end)
+        return self.dates[a:b], self.columns[measure][a:b]
+
+    def count(self, station, start = None, end = None):
+        a, b = self.slice(station, start, end)
+        return b - a
+
+    def to_arrays(self, prefix):
+        arrays = {
+            f"{prefix}/stations": np.array(self.stations, dtype = str),
+            f"{prefix}/starts": np.array([self.offsets[s][0] for s in self.stations], dtype = np.int64),
+            f"{prefix}/stops": np.array([self.offsets[s][1] for s in self.stations], dtype = np.int64),
+            f"{prefix}/dates": self.dates
+        }
+        arrays.update({f"{prefix}/column/{name}": values for name, values in self.columns.items()})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        columns = {key.split("/", 2)[2]: arrays[key] for key in arrays if key.startswith(f"{prefix}/column/")}
+        return cls(arrays[f"{prefix}/stations"].tolist(), arrays[f"{prefix}/starts"], arrays[f"{prefix}/stops"],
+                   arrays[f"{prefix}/dates"], columns)
+
+def build_rollups(grouped):
+    # Medias diarias, semanales y mensuales por estación, calculadas una vez
+    levels = {"raw": grouped}
+    for level, freq in LEVELS.items():
+        if freq is None:
+            continue
+        # Datos ya diarios -> El nivel diario es el mismo DataFrame que el original, sin copia
+        if freq == "D" and (grouped["date"] == grouped["date"].dt.normalize()).all():
+            levels[level] = grouped
+            continue
+        rollup = grouped.groupby(["station", pd.Grouper(key = "date", freq = freq)], observed = True).mean(numeric_only = True)
+        levels[level] = rollup.reset_index()
+    return levels
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling, returns the indices of
+    the points to keep (always including the first and last)
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype = np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Media del siguiente bucket (o el último punto)
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[stop:next_stop].mean() if next_stop > stop else x[-1]
+        avg_y = y[stop:next_stop].mean() if next_stop > stop else y[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+def minmax(x, y, n_out):
+    # Mínimo y máximo de cada bucket, conserva los picos
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    buckets = np.array_split(np.arange(n), max(1, n_out // 2))
+    y = np.asarray(y, dtype = float)
+    keep = [index for bucket in buckets if len(bucket)
+            for index in (bucket[np.argmin(y[bucket])], bucket[np.argmax(y[bucket])])]
+    return np.unique(keep)
+
+def downsample(dates, values, target = TARGET_POINTS, method = DOWNSAMPLING):
+    # Reduce una serie a target puntos (sin NaN)
+    valid = ~np.isnan(values)
+    dates, values = dates[valid], values[valid]
+    x = dates.astype(np.int64)
+    keep = lttb(x, values, target) if method == "lttb" else minmax(x, values, target)
+    return dates[keep], values[keep]
+
+def visible_range(relayout):
+    # Rango del eje x a partir de relayoutData, None si se ve todo
+    if not relayout or relayout.get("xaxis.autorange"):
+        return None
+    if "xaxis.range[0]" in relayout:
+        return pd.Timestamp(relayout["xaxis.range[0]"]), pd.Timestamp(relayout["xaxis.range[1]"])
+    if "xaxis.range" in relayout:
+        return pd.Timestamp(relayout["xaxis.range"][0]), pd.Timestamp(relayout["xaxis.range"][1])
+    return None
+
+def query(stores, stations, measure, x_range = None, target = TARGET_POINTS):
+    # Nivel más fino que no supera target puntos por estación en el rango visible
+    start, end = x_range if x_range is not None else (None, None)
+    for level in LEVELS:
+        store = stores[level]
+        if max([store.count(station, start, end) for station in stations], default = 0) <= target:
+            break
+    series = [(station,) + store.get(station, measure, start, end) for station in stations]
+    # Ni el nivel mensual cabe -> Downsampling del más grueso
+    if any(len(dates) > target for station, dates, values in series):
+        series = [(station,) + downsample(dates, values, target) for station, dates, values in series]
+    counts = [len(dates) for station, dates, values in series]
+    data = pd.DataFrame({
+        "station": np.repeat(stations, counts) if series else [],
+        "date": np.concatenate([dates for station, dates, values in series]) if series else [],
+        measure: np.concatenate([values for station, dates, values in series]) if series else []
+    })
+    return data, level
+
+def store_version():
+    # Versión de weather-pollution: fecha en metadata y archivo local
+    status, info = exists("weather-pollution")
+    path = storage.backend_path(info[3], storage.get_backend())
+    mtime = os.path.getmtime(path) if os.path.exists(path) else 0
+    return f"{info[2]}@{mtime}#{STORE_FORMAT}"
+
+def build_stores(weather_pollution):
+    grouped = weather_pollution.groupby(["station", "date"], observed = True).mean().reset_index()
+    order = list(pd.unique(weather_pollution["station"]))
+    # Los niveles con el mismo DataFrame comparten el store (y sus arrays)
+    built = {}
+    stores = {}
+    for level, data in build_rollups(grouped).items():
+        if id(data) not in built:
+            built[id(data)] = StationStore.from_frame(data, order)
+        stores[level] = built[id(data)]
+    return stores
+
+def stores_to_arrays(stores, version):
+    arrays = {"version": np.array(version)}
+    written = {}
+    for level, store in stores.items():
+        if id(store) in written:
+            # Mismo store que un nivel anterior -> Solo se guarda su nombre
+            arrays[f"{level}/alias"] = np.array(written[id(store)])
+        else:
+            arrays.update(store.to_arrays(level))
+            written[id(store)] = level
+    return arrays
+
+def stores_from_arrays(arrays):
+    stores = {}
+    for level in LEVELS:
+        alias = f"{level}/alias"
+        stores[level] = stores[str(arrays[alias])] if alias in arrays else StationStore.from_arrays(arrays, level)
+    return stores
+
+def save_stores(stores, path, version):
+    arrays = stores_to_arrays(stores, version)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = storage.tmp_path(path, ".tmp.npz")
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+def load_stores(path = None):
+    # Carga los stores guardados para esta versión de los datos, sino los construye y guarda
+    path = path or os.path.join(STORE_DIR, "timeseries.npz")
+    # Instantánea compartida (memory-mapped) publicada por el proceso cargador
+    attached = shared.attach_arrays("timeseries")
+    if attached is not None and str(attached[0]["version"]) == store_version():
+        return stores_from_arrays(attached[0])
+    # get_data comprueba si hay actualizaciones; con el backend feather la carga es memory-mapped
+    weather_pollution = get_data("weather-pollution")
+    version = store_version()
+    if os.path.exists(path):
+        with np.load(path) as file:
+            if str(file["version"]) == version:
+                return stores_from_arrays({key: file[key] for key in file.files})
+    stores = build_stores(weather_pollution)
+    save_stores(stores, path, version)
+    return stores
+
+def publish_stores():
+    # Publica los datasets y los stores en la instantánea compartida entre workers
+    stores = load_stores()
+    return shared.publish(extra = {"timeseries": stores_to_arrays(stores, store_version())})
+
+def republish():
+    # Tras actualizar datos: nueva instantánea si ya hay una en uso (los workers la adoptan en la siguiente petición)
+    if shared.current_version() is None:
+        return None
+    return publish_stores()
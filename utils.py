@@ -1,15 +1,33 @@
-from math import radians, cos, sin, asin, sqrt, pi
+import metadata
+from math import radians, cos, sin, asin, sqrt
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from spatial import SpatialIndex, SegmentIndex, build_trees_index, build_traffic_index, tree_density, traffic_per_day
 
 def exists(name):
-    # Carga archivo metadatos
-    with open("data/metadata.txt") as file:
-        for line in file.read().splitlines():
-            # Comprueba si existe 
-            if line.split(",")[0] == name:
-                # Entoces -> Devuelve True y info
-                return (True, line.split(","))
-    # Sino -> Devuelve False
-    return (False, [])
+    # Devuelve True e info si el dataset está en metadata.txt, sino False
+    return metadata.get(name)
+
+def dependency_graph():
+    return metadata.graph()
+
+def acquire_lock(path, blocking = False):
+    # Bloqueo exclusivo (flock) sobre path: devuelve el archivo abierto, o None si otro lo tiene
+    # Lo libera el sistema cuando se cierran todas sus copias (también si el proceso muere)
+    file = open(path, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return None
+    return file
+
+def release_lock(lock):
+    # Sin LOCK_UN: un proceso hijo que haya heredado el archivo sigue teniendo el bloqueo
+    lock.close()
 
 def haversine(lon1, lat1, lon2, lat2):
     """
@@ -29,30 +47,12 @@ def haversine(lon1, lat1, lon2, lat2):
 
 def calculate_tree_density(stations, trees, name, threshold = 1):
     station = stations[stations["name"] == name]
-    sta_lon = station["lon"]
-    sta_lat = station["lat"]
-    n_trees = 0
-    for tree in trees.iterrows():
-        tree = tree[1]
-        tree_lon = tree["lon"]
-        tree_lat = tree["lat"]
-        if haversine(sta_lon, sta_lat, tree_lon, tree_lat) <= threshold:
-            n_trees += tree["n"]
-    area = pi * threshold**2
-    density = n_trees/area
-    return density
-
-def calculate_traffic(stations, traffic, name, threshold = 0.5):
+    trees_index = trees if isinstance(trees, SpatialIndex) else build_trees_index(trees)
+    density = tree_density(station["lon"], station["lat"], trees_index, threshold)
+    return float(density[0])
+
+def calculate_traffic(stations, traffic, name, threshold = 0.5, how = "max"):
     station = stations[stations["name"] == name].iloc[0]
-    sta_lon = station["lon"]
-    sta_lat = station["lat"]
-    n_cars = []
-    for street in traffic.iterrows():
-        street = street[1]
-        coords_dict = dict(street["geo_shape"])["geometry"]["coordinates"]
-        lon, lat = coords_dict[0]
-        lon2, lat2 = coords_dict[1]
-        if haversine(sta_lon, sta_lat, lon, lat) <= threshold or haversine(sta_lon, sta_lat, lon2, lat2) <= threshold:
-            n_cars.append(street["cars_per_hour"])
-    cars_day = max(n_cars, default = 0)*24
-    return cars_day
\ No newline at end of file
+    traffic_index = traffic if isinstance(traffic, SegmentIndex) else build_traffic_index(traffic)
+    cars_day = traffic_per_day(station["lon"], station["lat"], traffic_index, threshold, how)
+    return float(cars_day[0])
\ No newline at end of file